@@ -0,0 +1,247 @@
+"""Micro-benchmarks for the per-message hot path in main.py.
+
+Each case processes a fixed, seeded corpus (emote-heavy Kick chat, long
+YouTube super-chat text, CJK/emoji Facebook comments) and is reported as
+time per message. Every case is timed in alternating rounds with a fixed
+reference workload that does not touch main.py, and the gate compares the
+median case/reference ratio with the recorded baseline, so a busy or
+slower machine moves both sides together. The run fails (exit 1) when a
+case's ratio grew by more than the tolerance:
+
+    python bench_hotpath.py                 # compare with bench_baseline.json
+    python bench_hotpath.py --save          # record a new baseline on this machine
+    python bench_hotpath.py --pyperf -o hotpath.json   # same cases under pyperf
+
+Ratios travel between machines far better than raw timings, but re-record
+the baseline after an interpreter upgrade.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import timeit
+import uuid
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("STREAMS_CONFIG", "")
+os.environ.setdefault("RULES_FILE", "")
+
+import main
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+CORPUS_SIZE = 500
+
+KICK_EMOTES = [(37226, "KEKW"), (39261, "PogU"), (37230, "LULW"), (39275, "catJAM"), (4148074, "GiftedYAY"),
+               (39272, "Sadge"), (305040, "ErectDance"), (39251, "monkaS")]
+WORDS = ("lets go that was insane chat gg no way what a play clip it hello from brazil first time here "
+         "love the stream when is the next one bro really just did that").split()
+CJK_EMOJI = ["こんにちは", "ありがとう", "最高", "加油", "大家好", "안녕하세요", "😂", "🔥", "❤️", "👍🏽",
+             "👨‍👩‍👧‍👦", "🇧🇷", "🎉", "😭"]
+
+
+def kick_corpus(rng: random.Random) -> list:
+    now = datetime.now(timezone.utc)
+    messages = []
+    for i in range(CORPUS_SIZE):
+        tokens = []
+        for _ in range(rng.randint(2, 14)):
+            if rng.random() < 0.4:
+                emote_id, name = rng.choice(KICK_EMOTES)
+                tokens.append(f"[emote:{emote_id}:{name}]")
+            else:
+                tokens.append(rng.choice(WORDS))
+        messages.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "content": " ".join(tokens),
+            "created_at": (now + timedelta(milliseconds=i * 50)).isoformat().replace("+00:00", "Z"),
+            "sender": {"username": f"viewer{rng.randint(1, 200)}"},
+        })
+    return messages
+
+
+def youtube_corpus(rng: random.Random) -> list:
+    items = []
+    for i in range(CORPUS_SIZE):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(40, 120))]
+        if rng.random() < 0.2:
+            words.append("a" * rng.randint(40, 200))  # keyboard mash, exercises long-word wrapping
+        items.append({
+            "id": f"LCC.{rng.getrandbits(64):x}",
+            "snippet": {"displayMessage": " ".join(words), "publishedAt": "2026-01-01T00:00:00Z"},
+            "authorDetails": {"displayName": f"Super Chatter {rng.randint(1, 50)}"},
+        })
+    return items
+
+
+def facebook_corpus(rng: random.Random) -> list:
+    return [{
+        "id": f"1234_{i}",
+        "from": {"name": f"Viewer {rng.randint(1, 300)}"},
+        "message": " ".join(rng.choice(CJK_EMOJI + WORDS) for _ in range(rng.randint(3, 30))),
+        "created_time": "2026-01-01T00:00:00+0000",
+    } for i in range(CORPUS_SIZE)]
+
+
+def build_cases() -> tuple:
+    """(reference, messages), and name -> (callable that processes one corpus, messages per call)."""
+    rng = random.Random(1234)
+    kick_raw = kick_corpus(rng)
+    yt_items = youtube_corpus(rng)
+    fb_comments = facebook_corpus(rng)
+
+    kick_start = main.parse_kick_time(kick_raw[0]["created_at"]).replace(microsecond=0)
+    kick_texts = [m["content"] for m in kick_raw]
+    mixed_texts = ([f"{m['sender']['username']}: {m['content']}" for m in kick_raw]
+                   + [f"{i['authorDetails']['displayName']}: {i['snippet']['displayMessage']}" for i in yt_items]
+                   + [f"{c['from']['name']}: {c['message']}" for c in fb_comments])
+    stream = main.Stream("bench")
+    ids = [stream.key(m["id"]) for m in kick_raw]
+
+    def reference():
+        # plain string work with no main.py code in it; only there to be timed next to each case
+        for text in mixed_texts:
+            " ".join(text.lower().split()).replace("@", "")
+
+    def clean_single_line():
+        for text in mixed_texts:
+            main.clean_single_line(text)
+
+    def split_message():
+        for text in mixed_texts:
+            main.split_message(text, main.MAX_SHORT_MSG_LEN)
+
+    def extract_emoji():
+        for text in kick_texts:
+            main.extract_emoji(text)
+
+    def dedup_checks():
+        cache = main.DedupCache()
+        for key in ids:  # first sighting
+            if key not in cache:
+                cache.add(key)
+        for key in ids:  # the same IDs again, as an overlapping poll would see them
+            if key not in cache:
+                cache.add(key)
+
+    def kick_live_chat():
+        # what get_live_chat does with one REST page
+        cursor = main.KickChatCursor()
+        cursor.since = kick_start  # pinned, so the whole corpus stays inside the window however long the run takes
+        for raw in cursor.advance(kick_raw):
+            main.kick_message(raw)
+
+    def fb_new_comments():
+        # what fetch_new_comments does with one page of comments
+        main.fb_seen_comment_ids.clear()
+        main.fb_last_message_by_user.clear()
+        for c in fb_comments:
+            main.is_new_fb_comment(stream, main.fb_comment(c))
+
+    def youtube_messages():
+        for item in yt_items:
+            main.youtube_message(item)
+
+    rules = main.RuleSet({
+        "deny_users": ["Nightbot", "StreamElements"],
+        "exclude": ["free followers", "cheap viewers", "spam"] + [f"badword{i}" for i in range(100)],
+        "mentions": ["@streamer", "streamer"],
+        "exclude_regex": [r"https?://\S+", r"\b(buy|sell)\s+followers\b"],
+    })
+    chat = [main.kick_message(m) for m in kick_raw]
+
+    def rules_check():
+        for msg in chat:
+            rules.check(msg)
+
+    return (reference, len(mixed_texts)), {
+        "clean_single_line": (clean_single_line, len(mixed_texts)),
+        "split_message": (split_message, len(mixed_texts)),
+        "extract_emoji": (extract_emoji, len(kick_texts)),
+        "dedup_checks": (dedup_checks, 2 * len(ids)),
+        "kick_live_chat": (kick_live_chat, len(kick_raw)),
+        "fb_new_comments": (fb_new_comments, len(fb_comments)),
+        "youtube_messages": (youtube_messages, len(yt_items)),
+        "rules_check": (rules_check, len(chat)),
+    }
+
+
+def measure(func, per_call: int, reference, repeat: int):
+    """Best-of-`repeat` nanoseconds per message, and the median ratio to `reference`.
+
+    The case and the reference alternate round by round, so a noisy
+    neighbour or a frequency change lands on both halves of each ratio.
+    """
+    timer, ref_timer = timeit.Timer(func), timeit.Timer(reference)
+    number, _ = timer.autorange()
+    ref_number, _ = ref_timer.autorange()
+    times, ratios = [], []
+    for _ in range(repeat):
+        ref = ref_timer.timeit(ref_number) / ref_number
+        took = timer.timeit(number) / number
+        times.append(took)
+        ratios.append(took / ref)
+    return min(times) / per_call * 1e9, statistics.median(ratios)
+
+
+def run_pyperf(cases: dict):
+    import pyperf
+    runner = pyperf.Runner()
+    for name, (func, per_call) in cases.items():
+        runner.bench_func(name, func, inner_loops=per_call)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", action="store_true", help="record the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed growth of a case's reference ratio before failing (0.25 = 25%%)")
+    parser.add_argument("--repeat", type=int, default=21, help="alternating case/reference rounds per case")
+    parser.add_argument("--only", action="append", help="run only this case (repeatable)")
+    parser.add_argument("--pyperf", action="store_true", help="run the cases under pyperf instead")
+    args, rest = parser.parse_known_args()
+
+    reference, cases = build_cases()
+    if args.only:
+        cases = {name: cases[name] for name in args.only}
+    if args.pyperf:
+        sys.argv = [sys.argv[0]] + rest
+        run_pyperf({"reference": reference, **cases})
+        return 0
+
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("vs_reference", {})
+    except (OSError, ValueError):
+        baseline = {}
+
+    results, ratios, regressions = {}, {}, []
+    for name, (func, per_call) in cases.items():
+        ns, ratio = measure(func, per_call, reference[0], args.repeat)
+        results[name], ratios[name] = ns, ratio
+        line = f"{name:<20} {ns:>10.0f} ns/msg {ratio:>8.3f}x ref"
+        if name in baseline:
+            change = ratio / baseline[name] - 1
+            line += f"   {change:+6.1%} vs baseline"
+            if change > args.tolerance:
+                regressions.append(name)
+                line += "   ❌ slower"
+        print(line)
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "ns_per_message": results, "vs_reference": ratios}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"💾 Baseline saved to {args.baseline}")
+        return 0
+    if regressions:
+        print(f"❌ Slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    print("✅ No regressions" if baseline else "ℹ️ No baseline yet, run with --save to record one")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,117 @@
+"""Replay Facebook Page webhook events against fb_app, signed like Graph signs them.
+
+Each line of the input file is one webhook payload (the JSON body Facebook
+POSTs). Without a file, synthetic comment events are generated. Replay into
+a running service:
+
+    FB_APP_SECRET=... python fb_event_replayer.py events.jsonl --url http://127.0.0.1:8000/webhook
+
+or fully offline, with fb_app served in-process by wsgiref:
+
+    FB_APP_SECRET=test FB_VERIFY_TOKEN=test python fb_event_replayer.py --serve --synthetic 50
+
+A running service only relays comments on its current live video, so
+synthetic events should use that video's post (--post <page>_<video>).
+With --serve, the posts in the replayed events are treated as live.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import Counter
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+import requests
+
+
+def synthetic_events(count: int, page_id: str, post_id: str = None) -> list:
+    now = int(time.time())
+    post_id = post_id or f"{page_id}_live"
+    return [{
+        "object": "page",
+        "entry": [{
+            "id": page_id,
+            "time": now + i,
+            "changes": [{
+                "field": "feed",
+                "value": {
+                    "item": "comment",
+                    "verb": "add",
+                    "comment_id": f"{page_id}_replay{now}{i}",
+                    "post_id": post_id,
+                    "from": {"id": str(1000 + i % 20), "name": f"Viewer {i % 20}"},
+                    "message": f"replayed comment {i}",
+                    "created_time": now + i,
+                },
+            }],
+        }],
+    } for i in range(count)]
+
+
+def sign(body: bytes, secret: str) -> str:
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def replay(events: list, url: str, secret: str, delay: float = 0.0) -> Counter:
+    statuses = Counter()
+    session = requests.Session()
+    for event in events:
+        body = json.dumps(event).encode("utf-8")
+        res = session.post(url, data=body, timeout=10, headers={
+            "Content-Type": "application/json",
+            "X-Hub-Signature-256": sign(body, secret),
+        })
+        statuses[res.status_code] += 1
+        if delay:
+            time.sleep(delay)
+    return statuses
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def event_posts(events: list) -> set:
+    return {str(change.get("value", {}).get("post_id")) for event in events
+            for entry in event.get("entry", []) for change in entry.get("changes", [])}
+
+
+def serve_in_process(live_posts=()):
+    """Serve main.fb_app on a free local port; returns the webhook URL."""
+    import main
+    for stream in main.STREAMS:
+        if stream.fb_page_id:
+            stream.fb_live_posts = frozenset(live_posts)
+    server = make_server("127.0.0.1", 0, main.fb_app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/webhook"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("events", nargs="?", help="JSONL file of webhook payloads")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/webhook")
+    parser.add_argument("--secret", default=os.getenv("FB_APP_SECRET", ""))
+    parser.add_argument("--synthetic", type=int, default=20, help="events to generate when no file is given")
+    parser.add_argument("--post", help="post ID of synthetic comments (default <page>_live)")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds between events")
+    parser.add_argument("--serve", action="store_true", help="serve fb_app in-process instead of using --url")
+    args = parser.parse_args()
+
+    if not args.secret:
+        parser.error("set FB_APP_SECRET or pass --secret")
+    if args.events:
+        with open(args.events, "r", encoding="utf-8") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = synthetic_events(args.synthetic, os.getenv("FB_PAGE_ID") or "0", args.post)
+
+    url = serve_in_process(event_posts(events)) if args.serve else args.url
+    print(f"🔁 Replaying {len(events)} event(s) to {url}")
+    print("📬 Responses:", dict(replay(events, url, args.secret, args.delay)))
+    if args.serve:
+        time.sleep(2)  # let the in-process engine log what it received
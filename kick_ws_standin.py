@@ -0,0 +1,102 @@
+"""Local stand-in for Kick's Pusher chatroom WebSocket.
+
+Speaks just enough of the Pusher protocol for `listen_kick_ws` in main.py:
+connection_established, subscribe/subscription_succeeded, ping/pong and
+App\\Events\\ChatMessageEvent. Point the listener at it with
+
+    KICK_PUSHER_URL=ws://127.0.0.1:8765/app/local python main.py
+
+and run `python kick_ws_standin.py --rate 120` to stream fake chat.
+"""
+import argparse
+import asyncio
+import json
+import uuid
+from datetime import datetime, timezone
+
+from websockets.asyncio.server import serve
+
+CHAT_EVENT = "App\\Events\\ChatMessageEvent"
+
+
+class PusherStandIn:
+    """In-process Pusher server: `publish` pushes a chat message to subscribers."""
+
+    def __init__(self):
+        self.subscribers = {}  # channel name -> set of connections
+        self.server = None
+
+    async def handler(self, ws):
+        await ws.send(json.dumps({
+            "event": "pusher:connection_established",
+            "data": json.dumps({"socket_id": uuid.uuid4().hex, "activity_timeout": 120}),
+        }))
+        channels = set()
+        try:
+            async for frame in ws:
+                event = json.loads(frame)
+                name = event.get("event")
+                if name == "pusher:subscribe":
+                    channel = event.get("data", {}).get("channel")
+                    channels.add(channel)
+                    self.subscribers.setdefault(channel, set()).add(ws)
+                    await ws.send(json.dumps({"event": "pusher_internal:subscription_succeeded",
+                                              "data": "{}", "channel": channel}))
+                elif name == "pusher:ping":
+                    await ws.send(json.dumps({"event": "pusher:pong", "data": "{}"}))
+        finally:
+            for channel in channels:
+                self.subscribers.get(channel, set()).discard(ws)
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await serve(self.handler, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def drop_all(self):
+        """Close every client connection, to exercise reconnect-with-resume."""
+        for conns in self.subscribers.values():
+            for ws in list(conns):
+                await ws.close()
+
+    async def publish(self, chatroom_id: int, username: str, content: str, message_id: str = None) -> dict:
+        message = {
+            "id": message_id or str(uuid.uuid4()),
+            "chatroom_id": chatroom_id,
+            "content": content,
+            "type": "message",
+            "created_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "sender": {"id": abs(hash(username)) % 10**8, "username": username, "slug": username.lower()},
+        }
+        channel = f"chatrooms.{chatroom_id}.v2"
+        frame = json.dumps({"event": CHAT_EVENT, "data": json.dumps(message), "channel": channel})
+        for ws in list(self.subscribers.get(channel, ())):
+            try:
+                await ws.send(frame)
+            except Exception:
+                pass
+        return message
+
+
+async def main(port: int, chatroom_id: int, rate: float):
+    standin = PusherStandIn()
+    port = await standin.start(port=port)
+    print(f"🧪 [Kick stand-in] ws://127.0.0.1:{port}/app/local, chatroom {chatroom_id}, {rate} msgs/min")
+    n = 0
+    while True:
+        await asyncio.sleep(60 / rate)
+        n += 1
+        await standin.publish(chatroom_id, f"viewer{n % 25}", f"test message {n} [emote:37226:KEKW]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chatroom", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=60, help="messages per minute")
+    args = parser.parse_args()
+    asyncio.run(main(args.port, args.chatroom, args.rate))
@@ -0,0 +1,366 @@
+"""Offline load simulator: the whole listener pipeline against local stub servers.
+
+Starts stub Graph (/videos, /comments, batch), YouTube (playlistItems, videos,
+liveChat/messages with pollingIntervalMillis and quotaExceeded), Kick (REST
+chat plus the Pusher stand-in from kick_ws_standin.py) and ntfy servers,
+points main.py at them, generates chat at a fixed rate per platform and
+reports throughput, drops and end-to-end lag (message created on the
+platform -> body received by ntfy):
+
+    python load_simulator.py --rate 1200 --duration 60
+    python load_simulator.py --rate 5000 --latency 80 --failure-rate 0.02 --platforms kick,facebook
+    python load_simulator.py --platforms youtube --yt-keys 2 --yt-quota-calls 30
+
+Every main.py setting can still be overridden through the environment;
+the simulator only fills in a load-test profile (batched ntfy, no YouTube
+delivery pacing, nothing persisted to disk).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+WORDS = ("lets go that was insane chat gg no way what a play clip it hello from brazil first time here "
+         "love the stream when is the next one bro really just did that").split()
+KICK_EMOTES = ["[emote:37226:KEKW]", "[emote:39261:PogU]", "[emote:4148074:GiftedYAY]"]
+SIM_ID = re.compile(r"\bsim(\d+)\b")
+KICK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+FB_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S+0000"
+
+PROFILE = {
+    "STREAMS_CONFIG": "",
+    "STATE_STORE": "",
+    "NTFY_WAL_DIR": "",
+    "NTFY_TOPIC": "sim",
+    "NTFY_BATCH": "1",
+    "RULES_FILE": "",
+    "YOUTUBE_QUOTA_FILE": "",
+    "YOUTUBE_NTFY_DELAY": "0",
+    "YOUTUBE_DAILY_QUOTA": "100000000",  # the stub decides when a key runs out
+    "HTTP_STATS_INTERVAL": "0",
+}
+
+
+class Simulator:
+    """Chat generated per platform, the stub endpoints serving it, and what ntfy received."""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.created = {}  # seq -> (platform, unix time the message was posted)
+        self.delivered = {}  # seq -> unix time ntfy received it
+        self.duplicates = 0
+        self.kick_log, self.fb_log, self.yt_log = [], [], []
+        self.requests = {}  # service -> requests served
+        self.failed = {}  # service -> failures injected
+        self.yt_key_calls = {}
+        self.ntfy_posts = 0
+
+    # --- chat generation ---
+    def next_message(self, platform: str):
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            now = time.time()
+            self.created[seq] = (platform, now)
+        words = [random.choice(WORDS) for _ in range(random.randint(2, 12))]
+        if platform == "Kick":
+            words += random.sample(KICK_EMOTES, random.randint(0, 2))
+        elif platform == "YouTube" and random.random() < 0.1:
+            words += [random.choice(WORDS) for _ in range(80)]  # super chat
+        return seq, now, f"sim{seq} " + " ".join(words), f"viewer{random.randint(1, 300)}"
+
+    async def generate(self, platform: str, standin=None):
+        interval = 60 / self.args.rate
+        deadline = time.monotonic() + self.args.duration
+        next_at = time.monotonic()
+        while next_at < deadline:
+            seq, now, text, user = self.next_message(platform)
+            if platform == "Kick":
+                if standin is not None:
+                    raw = await standin.publish(1, user, text, message_id=f"sim{seq}")
+                else:
+                    raw = {"id": f"sim{seq}", "content": text, "sender": {"username": user},
+                           "created_at": datetime.fromtimestamp(now, timezone.utc).isoformat().replace("+00:00", "Z")}
+                with self.lock:
+                    self.kick_log.append((now, raw))
+            elif platform == "Facebook":
+                with self.lock:
+                    self.fb_log.append((now, {"id": f"simpage_{seq}", "from": {"name": user}, "message": text,
+                                              "created_time": datetime.fromtimestamp(now, timezone.utc).strftime(FB_TIME_FORMAT)}))
+            else:
+                with self.lock:
+                    published = datetime.fromtimestamp(now, timezone.utc).isoformat().replace("+00:00", "Z")
+                    self.yt_log.append({"id": f"LCC.sim{seq}", "snippet": {"displayMessage": text, "publishedAt": published},
+                                        "authorDetails": {"displayName": user}})
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+    async def drop_kick_sockets(self, standin):
+        while True:
+            await asyncio.sleep(self.args.kick_ws_drop_every)
+            await standin.drop_all()
+
+    # --- stub endpoints: each returns (status, JSON-able body) ---
+    def graph(self, method: str, path: str, query: dict, form: dict):
+        path = re.sub(r"^/v\d+\.\d+", "", path).rstrip("/")
+        if method == "POST" and path == "":
+            replies = []
+            for entry in json.loads(form.get("batch", "[]")):
+                rel = urlsplit("/" + entry["relative_url"])
+                status, body = self.graph("GET", rel.path, {k: v[0] for k, v in parse_qs(rel.query).items()}, {})
+                replies.append({"code": status, "body": json.dumps(body)})
+            return 200, replies
+        parts = path.strip("/").split("/")
+        if len(parts) == 2 and parts[1] == "videos":
+            return 200, {"data": [{"id": "simvideo", "live_status": "LIVE", "description": "simulated"}]}
+        if len(parts) == 1:
+            return 200, {"id": parts[0], "live_status": "LIVE"}
+        if len(parts) == 2 and parts[1] == "comments":
+            limit = int(query.get("limit", 100))
+            with self.lock:
+                log = self.fb_log
+                if query.get("after"):
+                    start = int(query["after"])
+                else:
+                    since = int(query.get("since", 0))
+                    start = next((i for i, (t, _) in enumerate(log) if t >= since), len(log))
+                page = [c for _, c in log[start:start + limit]]
+                more = start + limit < len(log)
+            res = {"data": page}
+            if page:
+                after = str(start + len(page))
+                res["paging"] = {"cursors": {"after": after}}
+                if more:
+                    res["paging"]["next"] = (f"https://graph.facebook.com/v20.0/{parts[0]}/comments?"
+                                             + urlencode({**query, "after": after}))
+            return 200, res
+        return 404, {"error": {"message": f"unknown path {path}", "code": 803}}
+
+    def youtube(self, method: str, path: str, query: dict, form: dict):
+        key = query.get("key", "")
+        if path.endswith("/playlistItems"):
+            return 200, {"items": [{"contentDetails": {"videoId": "simvideo"}}]}
+        if path.endswith("/videos"):
+            return 200, {"items": [{"snippet": {"liveBroadcastContent": "live"},
+                                    "liveStreamingDetails": {"activeLiveChatId": "simchat"}}]}
+        if path.endswith("/liveChat/messages"):
+            with self.lock:
+                calls = self.yt_key_calls[key] = self.yt_key_calls.get(key, 0) + 1
+                if self.args.yt_quota_calls and calls > self.args.yt_quota_calls:
+                    return 403, {"error": {"code": 403, "message": "quota", "errors": [{"reason": "quotaExceeded"}]}}
+                start = int(query.get("pageToken") or 0)
+                page = self.yt_log[start:start + 500]
+            return 200, {"items": page, "nextPageToken": str(start + len(page)),
+                         "pollingIntervalMillis": self.args.yt_poll_ms}
+        return 404, {"error": {"code": 404, "message": f"unknown path {path}"}}
+
+    def kick(self, method: str, path: str, query: dict, form: dict):
+        parts = path.strip("/").split("/")
+        if parts[:3] == ["api", "v1", "channels"]:
+            return 200, {"id": 1, "slug": parts[3], "user_id": 1, "user": {}}
+        if parts[:3] == ["api", "v2", "channels"] and len(parts) == 5 and parts[4] == "messages":
+            start = datetime.strptime(query.get("start_time", "1970-01-01T00:00:00.000Z"), KICK_TIME_FORMAT)
+            start = start.replace(tzinfo=timezone.utc).timestamp()
+            with self.lock:
+                page = [raw for t, raw in self.kick_log if t >= start][-self.args.kick_page:]
+            return 200, {"data": {"messages": page}}
+        if parts[:3] == ["api", "v2", "channels"]:
+            return 200, {"id": 1, "slug": parts[3], "chatroom": {"id": 1}}
+        return 404, {"message": "not found"}
+
+    def ntfy(self, method: str, path: str, query: dict, body: bytes):
+        now = time.time()
+        with self.lock:
+            self.ntfy_posts += 1
+            for match in SIM_ID.finditer(body.decode("utf-8", "replace")):
+                seq = int(match.group(1))
+                if seq in self.delivered:
+                    self.duplicates += 1
+                else:
+                    self.delivered[seq] = now
+        return 200, {"id": f"n{self.ntfy_posts}", "event": "message"}
+
+    # --- reporting ---
+    def progress(self) -> str:
+        with self.lock:
+            return f"generated {self.seq}, delivered {len(self.delivered)}, ntfy posts {self.ntfy_posts}"
+
+    def report(self, elapsed: float, http_stats: dict) -> str:
+        lines = [f"\n📊 Simulation report ({self.args.rate:g} msgs/min per platform, {self.args.duration:g}s "
+                 f"+ {self.args.drain:g}s drain, latency {self.args.latency:g}ms, "
+                 f"failure rate {self.args.failure_rate:g}/ntfy {self.args.ntfy_failure_rate:g})"]
+        lines.append(f"{'platform':<10}{'sent':>8}{'delivered':>11}{'dropped':>9}{'msg/s':>8}"
+                     f"{'p50 lag':>9}{'p95 lag':>9}{'p99 lag':>9}{'max lag':>9}")
+        with self.lock:
+            created, delivered = dict(self.created), dict(self.delivered)
+        by_platform = {}
+        for seq, (platform, t) in created.items():
+            by_platform.setdefault(platform, []).append(delivered[seq] - t if seq in delivered else None)
+        totals = [0, 0]
+        for platform, lags in sorted(by_platform.items()):
+            got = sorted(lag for lag in lags if lag is not None)
+            totals[0] += len(lags)
+            totals[1] += len(got)
+
+            def pct(q):
+                return f"{got[int(q * (len(got) - 1))]:.2f}s" if got else "-"
+            lines.append(f"{platform:<10}{len(lags):>8}{len(got):>11}{len(lags) - len(got):>9}"
+                         f"{len(got) / elapsed:>8.1f}{pct(0.5):>9}{pct(0.95):>9}{pct(0.99):>9}{pct(1.0):>9}")
+        lines.append(f"{'total':<10}{totals[0]:>8}{totals[1]:>11}{totals[0] - totals[1]:>9}{totals[1] / elapsed:>8.1f}")
+        lines.append(f"ntfy posts: {self.ntfy_posts}, duplicate deliveries: {self.duplicates}")
+        lines.append("stub requests: " + ", ".join(f"{k} {v} ({self.failed.get(k, 0)} failed)"
+                                                   for k, v in sorted(self.requests.items())))
+        if self.yt_key_calls:
+            lines.append("YouTube liveChat calls per key: " + json.dumps(self.yt_key_calls))
+        lines.append("HTTP pool: " + json.dumps(http_stats))
+        return "\n".join(lines)
+
+
+def stub_handler(sim: Simulator, service: str):
+    """Request handler for one stub service, with injected latency and failures."""
+    failure_rate = sim.args.ntfy_failure_rate if service == "ntfy" else sim.args.failure_rate
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+        def log_message(self, *args):
+            pass
+
+        def handle_any(self, method: str):
+            url = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with sim.lock:
+                sim.requests[service] = sim.requests.get(service, 0) + 1
+            if sim.args.latency:
+                time.sleep(sim.args.latency / 1000 * random.uniform(0.5, 1.5))
+            if random.random() < failure_rate:
+                with sim.lock:
+                    sim.failed[service] = sim.failed.get(service, 0) + 1
+                status, res = 500, {"error": {"code": 500, "message": "injected failure"}}
+            elif service == "ntfy":
+                status, res = sim.ntfy(method, url.path, query, body)
+            else:
+                form = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()} if body else {}
+                status, res = getattr(sim, service)(method, url.path, query, form)
+            data = json.dumps(res).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.handle_any("GET")
+
+        def do_POST(self):
+            self.handle_any("POST")
+
+    return Handler
+
+
+def start_stub(sim: Simulator, service: str) -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stub_handler(sim, service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class StubAdapter(HTTPAdapter):
+    """Send every request of a session to a stub server, keeping path and query."""
+
+    def __init__(self, base: str):
+        super().__init__()
+        self.base = base
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.url = self.base + url.path + (f"?{url.query}" if url.query else "")
+        return super().send(request, **kwargs)
+
+
+async def simulate(args) -> int:
+    sim = Simulator(args)
+    platforms = {p.strip().lower() for p in args.platforms.split(",") if p.strip()}
+    stubs = {service: start_stub(sim, service) for service in ("graph", "youtube", "kick", "ntfy")}
+
+    standin = None
+    if "kick" in platforms and args.kick_mode == "ws":
+        from kick_ws_standin import PusherStandIn
+        standin = PusherStandIn()
+        port = await standin.start(port=0)
+        os.environ["KICK_PUSHER_URL"] = f"ws://127.0.0.1:{port}/app/sim"
+
+    for key, value in PROFILE.items():
+        os.environ.setdefault(key, value)
+    os.environ["KICK_WEBSOCKET"] = "1" if standin is not None else "0"
+    os.environ["KICK_CHANNEL"] = "simchannel" if "kick" in platforms else ""
+    os.environ["YOUTUBE_CHANNEL_ID"] = "simchannel" if "youtube" in platforms else ""
+    os.environ["YOUTUBE_API_KEY"] = ""
+    os.environ["YOUTUBE_API_KEYS"] = ",".join(f"sim-key-{i}" for i in range(1, args.yt_keys + 1))
+    os.environ["FB_PAGE_ID"] = "simpage" if "facebook" in platforms else ""
+    os.environ["FB_PAGE_TOKEN"] = "sim-token"
+
+    report_out = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")  # the pipeline logs every message
+    import main
+    for host, service in (("graph.facebook.com", "graph"), ("www.googleapis.com", "youtube"), ("ntfy.sh", "ntfy")):
+        main.http_pool.session(host).mount("https://", StubAdapter(stubs[service]))
+    main.kick_api.session.mount("https://", StubAdapter(stubs["kick"]))
+    main.start_all_listeners()
+
+    print(f"🧪 Simulating {', '.join(sorted(platforms))} at {args.rate:g} msgs/min each for {args.duration:g}s "
+          f"(kick via {'websocket' if standin else 'polling'}, ntfy batching {'on' if main.NTFY_BATCH else 'off'})",
+          file=sys.stderr)
+    await asyncio.sleep(args.warmup)  # let the listeners attach before chat starts
+    started = time.monotonic()
+    names = {"kick": "Kick", "facebook": "Facebook", "youtube": "YouTube"}
+    tasks = [asyncio.create_task(sim.generate(names[p], standin)) for p in platforms if p in names]
+    if standin is not None and args.kick_ws_drop_every:
+        dropper = asyncio.create_task(sim.drop_kick_sockets(standin))
+    else:
+        dropper = None
+
+    end = started + args.duration + args.drain
+    while time.monotonic() < end:
+        await asyncio.sleep(min(5, max(0.0, end - time.monotonic())))
+        print(f"⏱️ {time.monotonic() - started:5.0f}s  {sim.progress()}", file=sys.stderr)
+    await asyncio.gather(*tasks)
+    if dropper is not None:
+        dropper.cancel()
+
+    print(sim.report(time.monotonic() - started, main.http_pool.stats()), file=report_out)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=600, help="messages per minute per platform (100-5000)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of generated chat")
+    parser.add_argument("--drain", type=float, default=15, help="seconds to wait for the pipeline to catch up")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds between starting listeners and chat")
+    parser.add_argument("--platforms", default="kick,youtube,facebook")
+    parser.add_argument("--latency", type=float, default=0, help="mean injected latency per stub request (ms)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of platform API requests answered 500")
+    parser.add_argument("--ntfy-failure-rate", type=float, default=0.0, help="share of ntfy posts answered 500")
+    parser.add_argument("--yt-keys", type=int, default=1, help="YouTube API keys to configure")
+    parser.add_argument("--yt-quota-calls", type=int, default=0, help="liveChat calls per key before quotaExceeded")
+    parser.add_argument("--yt-poll-ms", type=int, default=2000, help="pollingIntervalMillis returned by the stub")
+    parser.add_argument("--kick-mode", choices=("ws", "poll"), default="ws")
+    parser.add_argument("--kick-ws-drop-every", type=float, default=0, help="close Kick sockets every N seconds")
+    parser.add_argument("--kick-page", type=int, default=50, help="messages per Kick REST page")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    sys.exit(asyncio.run(simulate(parser.parse_args())))
@@ -4,9 +4,34 @@ import requests
 import re
 import threading
 import json
-from datetime import datetime, timedelta
-from queue import Queue
+import asyncio
+import functools
+import hashlib
+import hmac
+import math
+import sqlite3
+import struct
+import zlib
+import mmap
+import bisect
+import random
+import atexit
+import subprocess
+import sys
+import argparse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from urllib.parse import urlsplit, urlencode, parse_qs
+from requests.adapters import HTTPAdapter
 from kickapi import KickAPI
+from kickapi.channel_data import ChannelData
+
+try:
+    from websockets.asyncio.client import connect as ws_connect
+except ImportError:  # Kick falls back to REST polling
+    ws_connect = None
 
 # =====================================================
 # --- Environment Variables ---
@@ -15,104 +40,1979 @@ FB_PAGE_ID = os.getenv("FB_PAGE_ID")
 FB_PAGE_TOKEN = os.getenv("FB_PAGE_TOKEN")
 FB_APP_ID = os.getenv("FB_APP_ID")
 FB_APP_SECRET = os.getenv("FB_APP_SECRET")
+FB_VERIFY_TOKEN = os.getenv("FB_VERIFY_TOKEN")
+FB_PUSH_GRACE = float(os.getenv("FB_PUSH_GRACE", 120))  # webhook counts as live for this long
+FB_PUSH_FALLBACK_INTERVAL = float(os.getenv("FB_PUSH_FALLBACK_INTERVAL", 30))  # poll gap while push works
+FB_COMMENTS_PAGE_SIZE = int(os.getenv("FB_COMMENTS_PAGE_SIZE", 100))
+FB_MAX_PAGES_PER_POLL = int(os.getenv("FB_MAX_PAGES_PER_POLL", 20))  # the rest is picked up next poll
+FB_INITIAL_LOOKBACK = int(os.getenv("FB_INITIAL_LOOKBACK", 60))  # seconds of comments fetched on attach
+FB_LIVE_CHECK_INTERVAL = float(os.getenv("FB_LIVE_CHECK_INTERVAL", 30))
 
 KICK_CHANNEL = os.getenv("KICK_CHANNEL", "")
 KICK_POLL_INTERVAL = float(os.getenv("KICK_POLL_INTERVAL", 5))
 KICK_TIME_WINDOW_MINUTES = float(os.getenv("KICK_TIME_WINDOW_MINUTES", 0.1))
+KICK_MAX_BACKFILL_MINUTES = float(os.getenv("KICK_MAX_BACKFILL_MINUTES", 5))  # widest catch-up after a stall
+KICK_WEBSOCKET = os.getenv("KICK_WEBSOCKET", "1") == "1"  # push ingestion, polling stays as fallback
+KICK_PUSHER_URL = os.getenv("KICK_PUSHER_URL", "wss://ws-us2.pusher.com/app/32cbd69e4b950bf97679?protocol=7&client=js&version=8.4.0&flash=false")
+KICK_WS_MAX_FAILURES = int(os.getenv("KICK_WS_MAX_FAILURES", 5))  # consecutive drops before polling
+KICK_WS_ACTIVITY_TIMEOUT = float(os.getenv("KICK_WS_ACTIVITY_TIMEOUT", 120))
+KICK_WS_PONG_TIMEOUT = float(os.getenv("KICK_WS_PONG_TIMEOUT", 10))  # silence after our ping means a dead socket
 
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY", "")
 YOUTUBE_CHANNEL_ID = os.getenv("YOUTUBE_CHANNEL_ID", "")
 YOUTUBE_NTFY_DELAY = float(os.getenv("YOUTUBE_NTFY_DELAY", 2))
+YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", 10000))  # units per key per day
+YOUTUBE_QUOTA_RESERVE = int(os.getenv("YOUTUBE_QUOTA_RESERVE", 300))  # kept back for reconnect lookups
+YOUTUBE_OFFLINE_SHARE = float(os.getenv("YOUTUBE_OFFLINE_SHARE", 0.25))  # of the spare quota, for live checks while offline
+YOUTUBE_QUOTA_FILE = os.getenv("YOUTUBE_QUOTA_FILE", ".youtube_quota.json")
+YOUTUBE_QUOTA_SAVE_INTERVAL = float(os.getenv("YOUTUBE_QUOTA_SAVE_INTERVAL", 30))
+YOUTUBE_STREAM_HOURS = float(os.getenv("YOUTUBE_STREAM_HOURS", 3))  # how long the quota has to last once live
 
 NTFY_TOPIC = os.getenv("NTFY_TOPIC", "streamchats123")
+STREAMS_CONFIG = os.getenv("STREAMS_CONFIG", "streams.json")  # many channels per process, see streams.example.json
+STATE_STORE = os.getenv("STATE_STORE", "")  # e.g. sqlite:///state.db, shared by sharded workers
+LEASE_TTL = float(os.getenv("LEASE_TTL", 30))  # a dead worker's streams move after this long
+CURSOR_CHECKPOINT_INTERVAL = float(os.getenv("CURSOR_CHECKPOINT_INTERVAL", 1))
+STATE_STORE_COMMIT_INTERVAL = float(os.getenv("STATE_STORE_COMMIT_INTERVAL", 0.05))  # claims batched this long (s)
 
-# per-user last message tracking
-kick_last_message_by_user = {}
-yt_last_message_by_user = {}
-fb_last_message_by_user = {}
+NTFY_WAL_DIR = os.getenv("NTFY_WAL_DIR", "")  # on-disk outbound log; empty keeps the queue in memory only
+NTFY_WAL_SEGMENT_BYTES = int(os.getenv("NTFY_WAL_SEGMENT_BYTES", 8 * 1024 * 1024))
+NTFY_WAL_COMMIT_INTERVAL = float(os.getenv("NTFY_WAL_COMMIT_INTERVAL", 0.05))  # group-commit window (s)
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # JSONL of per-message stage timestamps; empty disables tracing
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", 0.01))  # share of messages traced
+
+CHAT_ARCHIVE = os.getenv("CHAT_ARCHIVE", "")  # SQLite file every message is archived to; empty disables
+CHAT_ARCHIVE_FLUSH_INTERVAL = float(os.getenv("CHAT_ARCHIVE_FLUSH_INTERVAL", 1))
+CHAT_ARCHIVE_MAX_PENDING = int(os.getenv("CHAT_ARCHIVE_MAX_PENDING", 100000))  # oldest unwritten rows dropped past this
+CHAT_ARCHIVE_SESSION_GAP = float(os.getenv("CHAT_ARCHIVE_SESSION_GAP", 1800))  # silence that ends a stream (s)
+
+ANALYTICS_WINDOW = int(os.getenv("ANALYTICS_WINDOW", 60))  # seconds covered by the rolling message rate
+ANALYTICS_TOP_USERS = int(os.getenv("ANALYTICS_TOP_USERS", 50))  # chatters tracked per stream (Space-Saving)
+ANALYTICS_SPIKE_BUCKET = float(os.getenv("ANALYTICS_SPIKE_BUCKET", 10))  # seconds per spike-detection bucket
+ANALYTICS_SPIKE_Z = float(os.getenv("ANALYTICS_SPIKE_Z", 3))  # standard deviations above normal that count as a spike
+ANALYTICS_SPIKE_MIN = int(os.getenv("ANALYTICS_SPIKE_MIN", 10))  # messages a bucket needs before it can be a spike
+ANALYTICS_SUMMARY_INTERVAL = float(os.getenv("ANALYTICS_SUMMARY_INTERVAL", 0))  # ntfy chat summary every N s; 0 disables
+
+RULES_FILE = os.getenv("RULES_FILE", "rules.json")  # which messages reach ntfy, see rules.example.json
+MESSAGE_DELAY = float(os.getenv("MESSAGE_DELAY", 5))  # delay in seconds between notifications
+
+ENGINE_IO_WORKERS = int(os.getenv("ENGINE_IO_WORKERS", 8))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 4))  # keep-alive connections kept per host
+HTTP_HOST_CONCURRENCY = int(os.getenv("HTTP_HOST_CONCURRENCY", 4))  # in-flight calls per host
+HTTP_STATS_INTERVAL = float(os.getenv("HTTP_STATS_INTERVAL", 600))  # 0 disables the report
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 15))  # default per request, so a hung socket frees its I/O thread
+
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", 3 * 3600))  # seconds an ID is remembered exactly
+DEDUP_MAX_ITEMS = int(os.getenv("DEDUP_MAX_ITEMS", 20000))  # exact IDs kept per platform
+DEDUP_BLOOM_CAPACITY = int(os.getenv("DEDUP_BLOOM_CAPACITY", 0))  # 0 disables the Bloom history
+DEDUP_BLOOM_ERROR_RATE = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", 0.001))
+LAST_MESSAGE_MAX_USERS = int(os.getenv("LAST_MESSAGE_MAX_USERS", 5000))
+
+NTFY_BATCH = os.getenv("NTFY_BATCH", "0") == "1"  # pack several chat lines per notification
+NTFY_BATCH_MAX_BYTES = int(os.getenv("NTFY_BATCH_MAX_BYTES", 3800))  # ntfy caps bodies at 4096 bytes
+NTFY_BATCH_MIN_INTERVAL = float(os.getenv("NTFY_BATCH_MIN_INTERVAL", 1))
+NTFY_BATCH_MAX_INTERVAL = float(os.getenv("NTFY_BATCH_MAX_INTERVAL", 5))
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "json" writes one JSON object per line
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 0.2))
+LOG_BUFFER_LINES = int(os.getenv("LOG_BUFFER_LINES", 20000))  # oldest lines are dropped past this
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")  # share of lines kept per category, e.g. "chat=0.1"
+LOG_RATE_LIMIT = os.getenv("LOG_RATE_LIMIT", "chat=100,warn=20,error=20")  # lines/second per category
+
+# =====================================================
+# --- Logging ---
+# =====================================================
+def parse_category_map(spec: str) -> dict:
+    out = {}
+    for item in spec.split(","):
+        if "=" in item:
+            category, value = item.split("=", 1)
+            out[category.strip()] = float(value)
+    return out
+
+class LogBuffer:
+    """Structured log lines, buffered in memory and written by a background thread.
+
+    `log()` only samples, rate-limits and appends a tuple to a deque
+    (appends and pops are atomic, so callers never take a lock or touch
+    stdout); the writer formats and writes everything queued in one go
+    every LOG_FLUSH_INTERVAL. A message with fields is a str.format
+    template, so lines that get sampled away are never formatted.
+    Categories: chat (one line per message), info, warn, error.
+    """
+
+    def __init__(self, fmt=LOG_FORMAT, max_lines=LOG_BUFFER_LINES,
+                 sample=LOG_SAMPLE, rate_limit=LOG_RATE_LIMIT, out=None):
+        self.json = fmt == "json"
+        self.lines = deque()
+        self.max_lines = max_lines
+        self.sample = parse_category_map(sample)
+        self.rate_limit = parse_category_map(rate_limit)
+        self.windows = {}  # category -> [second, lines logged in it]
+        self.suppressed = {}  # category -> lines dropped by sampling, rate limit or a full buffer
+        self.out = out
+        self.writer = None
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def log(self, category: str, message: str, **fields):
+        keep = self.sample.get(category)
+        if keep is not None and random.random() >= keep:
+            return self._suppress(category)
+        limit = self.rate_limit.get(category)
+        if limit is not None:
+            now = int(time.time())
+            window = self.windows.get(category)
+            if window is None or window[0] != now:
+                window = self.windows[category] = [now, 0]
+            if window[1] >= limit:
+                return self._suppress(category)
+            window[1] += 1  # racy across threads, which only makes the limit approximate
+        if len(self.lines) >= self.max_lines:
+            return self._suppress(category)
+        self.lines.append((time.time(), category, message, fields))
+        if self.writer is None:
+            self.start()
+
+    def _suppress(self, category: str):
+        self.suppressed[category] = self.suppressed.get(category, 0) + 1
+
+    def format(self, ts: float, category: str, message: str, fields: dict) -> str:
+        if fields:
+            text = message.format(**{k: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v
+                                     for k, v in fields.items()})
+        else:
+            text = message
+        if not self.json:
+            return text
+        return json.dumps({"ts": datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds"),
+                           "category": category, "msg": text, **fields}, ensure_ascii=False, default=str)
+
+    def flush(self):
+        out = []
+        while self.lines:
+            try:
+                out.append(self.format(*self.lines.popleft()))
+            except Exception as e:  # a bad template must not take the writer down
+                out.append(f"⚠️ [Log] Could not format a line: {e}")
+        if self.suppressed:
+            suppressed, self.suppressed = self.suppressed, {}
+            summary = ", ".join(f"{n} {category}" for category, n in sorted(suppressed.items()))
+            out.append(self.format(time.time(), "info", f"🔇 [Log] Suppressed {summary} line(s)", {}))
+        if out:
+            stream = self.out or sys.stdout
+            stream.write("\n".join(out) + "\n")
+            stream.flush()
+
+    def run(self):
+        while True:
+            self._wake.wait(LOG_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def start(self):
+        with self._start_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.run, name="log-writer", daemon=True)
+                self.writer.start()
+                atexit.register(self.flush)
+
+log_buffer = LogBuffer()
+log = log_buffer.log
+
+# =====================================================
+# --- Dedup Cache ---
+# =====================================================
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys."""
+
+    def __init__(self, capacity: int, error_rate: float = DEDUP_BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DedupCache:
+    """Bounded seen-set / last-value map with TTL and LRU eviction.
+
+    Entries live for `ttl` seconds and at most `max_items` are kept. When
+    `bloom_capacity` is set, evicted keys are folded into two rotating Bloom
+    filters, so old IDs are still recognised at a fixed memory cost.
+    """
+
+    def __init__(self, ttl=DEDUP_TTL, max_items=DEDUP_MAX_ITEMS, bloom_capacity=DEDUP_BLOOM_CAPACITY):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.bloom_capacity = bloom_capacity
+        self._items = OrderedDict()  # key -> (expires_at, value), oldest first
+        self._blooms = [BloomFilter(bloom_capacity)] if bloom_capacity else []
+
+    def _evict(self, now: float):
+        items = self._items
+        while items:
+            key, (expires_at, _) = next(iter(items.items()))
+            if expires_at > now and len(items) <= self.max_items:
+                break
+            items.popitem(last=False)
+            if self._blooms:
+                self._remember(key)
+
+    def _remember(self, key):
+        bloom = self._blooms[0]
+        if bloom.count >= self.bloom_capacity:
+            bloom = BloomFilter(self.bloom_capacity)
+            self._blooms = [bloom, self._blooms[0]]
+        bloom.add(key)
+
+    def __contains__(self, key) -> bool:
+        entry = self._items.get(key)
+        if entry is not None:
+            # an expired entry is only waiting to be folded into the Bloom history
+            return entry[0] > time.monotonic() or bool(self._blooms)
+        return any(key in bloom for bloom in self._blooms)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, key) -> bool:
+        """Mark `key` as seen; returns False if it was already seen.
+
+        This is the in-process check only; with a shared store, SharedClaims
+        settles which worker notifies a message.
+        """
+        if key in self:
+            return False
+        self[key] = True
+        return True
+
+    def get(self, key, default=None):
+        entry = self._items.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def __setitem__(self, key, value):
+        now = time.monotonic()
+        self._items[key] = (now + self.ttl, value)
+        self._items.move_to_end(key)
+        self._evict(now)
+
+    def clear(self):
+        self._items.clear()
+        if self._blooms:
+            self._blooms = [BloomFilter(self.bloom_capacity)]
+
+# =====================================================
+# --- Shared State Store ---
+# =====================================================
+class SQLiteStateStore:
+    """Leases, worker heartbeats, claimed message IDs, undelivered claims and cursors in one SQLite file.
+
+    WAL mode lets every worker process on the host share the file. Other
+    backends only need the same methods; register them in STATE_STORES.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS leases (stream TEXT PRIMARY KEY, worker TEXT NOT NULL, expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS workers (worker TEXT PRIMARY KEY, heartbeat REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS seen (ns TEXT NOT NULL, key TEXT NOT NULL, expires REAL NOT NULL,
+                                             PRIMARY KEY (ns, key)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS cursors (stream TEXT NOT NULL, platform TEXT NOT NULL, state TEXT NOT NULL,
+                                                PRIMARY KEY (stream, platform));
+            CREATE TABLE IF NOT EXISTS pending (ns TEXT NOT NULL, key TEXT NOT NULL, stream TEXT NOT NULL,
+                                                worker TEXT NOT NULL, message TEXT NOT NULL,
+                                                PRIMARY KEY (ns, key)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS pending_stream ON pending (stream);
+        """)
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self.db.execute(sql, params)
+
+    # --- leases / membership
+    def heartbeat(self, worker: str):
+        self._execute("INSERT INTO workers VALUES (?, ?) ON CONFLICT(worker) DO UPDATE SET heartbeat = excluded.heartbeat",
+                      (worker, time.time()))
+
+    def live_workers(self, ttl: float = LEASE_TTL) -> list:
+        rows = self._execute("SELECT worker FROM workers WHERE heartbeat > ? ORDER BY worker", (time.time() - ttl,))
+        return [row[0] for row in rows.fetchall()]
+
+    def acquire_lease(self, stream: str, worker: str, ttl: float = LEASE_TTL) -> bool:
+        """Take or renew a stream's lease; fails while another worker holds it."""
+        now = time.time()
+        cur = self._execute(
+            "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(stream) DO UPDATE "
+            "SET worker = excluded.worker, expires = excluded.expires "
+            "WHERE leases.worker = excluded.worker OR leases.expires < ?",
+            (stream, worker, now + ttl, now))
+        return cur.rowcount == 1
+
+    def release_lease(self, stream: str, worker: str):
+        self._execute("DELETE FROM leases WHERE stream = ? AND worker = ?", (stream, worker))
+
+    def leases(self) -> dict:
+        rows = self._execute("SELECT stream, worker FROM leases WHERE expires > ?", (time.time(),))
+        return dict(rows.fetchall())
+
+    # --- dedup and delivery
+    def commit(self, worker: str, claims: list, delivered: list, cursors: dict, ttl: float = DEDUP_TTL) -> list:
+        """One transaction: claim IDs, forget delivered ones, save cursors.
+
+        `claims` are (ns, key, stream, message JSON); a won claim is kept in
+        `pending` until it shows up in a later `delivered`, so whoever takes
+        the stream over can still send it. Returns whether each claim was won.
+        """
+        now = time.time()
+        won = []
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for ns, key, stream, message in claims:
+                    cur = self.db.execute("INSERT OR IGNORE INTO seen VALUES (?, ?, ?)", (ns, key, now + ttl))
+                    won.append(cur.rowcount == 1)
+                    if won[-1]:
+                        self.db.execute("INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?, ?)",
+                                        (ns, key, stream, worker, message))
+                self.db.executemany("DELETE FROM pending WHERE ns = ? AND key = ?", delivered)
+                self.db.executemany(
+                    "INSERT INTO cursors VALUES (?, ?, ?) ON CONFLICT(stream, platform) DO UPDATE SET state = excluded.state",
+                    [(stream, platform, json.dumps(state)) for (stream, platform), state in cursors.items()])
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return won
+
+    def adopt(self, stream: str, worker: str, ttl: float = LEASE_TTL) -> list:
+        """Take over a stream's undelivered claims; returns (ns, key, message JSON).
+
+        Only claims nobody holds any more are taken: ones given up with
+        disown(), or held by a worker whose heartbeat is older than `ttl`.
+        A live worker may still have its claims queued and will send them.
+        """
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.db.execute(
+                    "SELECT ns, key, message FROM pending WHERE stream = ? AND worker != ? AND (worker = '' OR "
+                    "worker NOT IN (SELECT worker FROM workers WHERE heartbeat > ?))",
+                    (stream, worker, time.time() - ttl)).fetchall()
+                self.db.executemany("UPDATE pending SET worker = ? WHERE ns = ? AND key = ?",
+                                    [(worker, ns, key) for ns, key, _ in rows])
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def disown(self, worker: str, stream: str = None, keep=frozenset()):
+        """Give up `worker`'s undelivered claims (on one stream), except `keep`, so a lease holder adopts them."""
+        with self._lock:
+            rows = self.db.execute("SELECT ns, key FROM pending WHERE worker = ?" + (" AND stream = ?" if stream else ""),
+                                   (worker, stream) if stream else (worker,)).fetchall()
+            self.db.executemany("UPDATE pending SET worker = '' WHERE ns = ? AND key = ? AND worker = ?",
+                                [(ns, key, worker) for ns, key in rows if (ns, key) not in keep])
+
+    def owned(self, worker: str, claims: list) -> dict:
+        """Which of these (ns, key) claims are still undelivered and held by `worker`, with their stream."""
+        with self._lock:
+            owned = {}
+            for claim in claims:
+                row = self.db.execute("SELECT stream FROM pending WHERE ns = ? AND key = ? AND worker = ?",
+                                      (*claim, worker)).fetchone()
+                if row:
+                    owned[claim] = row[0]
+            return owned
+
+    def expire(self):
+        self._execute("DELETE FROM seen WHERE expires < ?", (time.time(),))
+
+    # --- cursors
+    def save_cursor(self, stream: str, platform: str, state: dict):
+        self._execute("INSERT INTO cursors VALUES (?, ?, ?) ON CONFLICT(stream, platform) DO UPDATE SET state = excluded.state",
+                      (stream, platform, json.dumps(state)))
+
+    def load_cursor(self, stream: str, platform: str):
+        row = self._execute("SELECT state FROM cursors WHERE stream = ? AND platform = ?", (stream, platform)).fetchone()
+        return json.loads(row[0]) if row else None
+
+STATE_STORES = {"sqlite": lambda location: SQLiteStateStore(location)}
+
+def open_state_store(url: str = STATE_STORE):
+    """`scheme:///location`, e.g. sqlite:///state.db; None when unset."""
+    if not url:
+        return None
+    scheme, _, location = url.partition("://")
+    factory = STATE_STORES.get(scheme)
+    if factory is None:
+        raise ValueError(f"Unknown STATE_STORE scheme '{scheme}' (known: {', '.join(STATE_STORES)})")
+    return factory(location[1:] if location.startswith("/") and scheme == "sqlite" else location)
+
+state_store = None
+
+# =====================================================
+# --- Chat Message ---
+# =====================================================
+class ChatMessage:
+    """One chat message from any platform, parsed once where it is fetched.
+
+    Every stage after the platform adapters (dedup, queue, log, senders)
+    works on this record. Slots keep it small; platform and user names
+    repeat constantly, so they are interned and shared between messages.
+    """
+
+    __slots__ = ("platform", "id", "user", "text", "created", "topic", "offset", "claim", "received", "trace")
+
+    def __init__(self, platform: str, id, user: str, text: str, created: str = "", topic: str = None):
+        self.platform = sys.intern(platform)
+        self.id = id
+        self.user = sys.intern(user or "Unknown")
+        self.text = text or ""
+        self.created = created or ""
+        self.topic = topic
+        self.offset = None  # position in the outbound log, see NtfyLog
+        self.claim = None  # (ns, key) in the shared store until sent, see SharedClaims
+        self.received = time.monotonic()  # when we got it, for the notification lag metric
+        # stage -> unix time, for the sampled few written to TRACE_FILE
+        self.trace = {"fetched": time.time()} if TRACE_FILE and random.random() < TRACE_SAMPLE else None
+
+    def __repr__(self):
+        return f"ChatMessage({self.platform!r}, {self.id!r}, {self.user!r}, {self.text!r})"
+
+    def mark(self, stage: str, at: float = None):
+        if self.trace is not None:
+            self.trace[stage] = at if at is not None else time.time()
+
+    def mark_sent(self):
+        if self.trace is not None:
+            self.trace.setdefault("sent", []).append(time.time())
+
+    def to_dict(self) -> dict:
+        d = {"title": self.platform, "id": self.id, "user": self.user, "msg": self.text,
+             "created": self.created, "topic": self.topic}
+        if self.claim is not None:
+            d["claim"] = list(self.claim)
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ChatMessage":
+        msg = cls(d.get("title", "Chat"), d.get("id"), d.get("user", "Unknown"), d.get("msg", ""),
+                  d.get("created", ""), d.get("topic"))
+        if d.get("claim"):
+            msg.claim = tuple(d["claim"])
+        return msg
+
+# =====================================================
+# --- Outbound Write-Ahead Log ---
+# =====================================================
+class NtfyLog:
+    """Append-only, segmented on-disk log behind the outbound ntfy queue.
+
+    Records are `<u32 length><u32 crc32><json>` in segment files named by
+    the offset of their first record, so a reader can mmap a segment and
+    walk it without an index. Appends only reach the OS buffer; a
+    background task fsyncs all of them together every
+    NTFY_WAL_COMMIT_INTERVAL (group commit). Acks can arrive out of order
+    (lanes are round-robin); the committed offset is the end of the
+    contiguous acked prefix, and on startup only records at or after it are
+    replayed. A torn record at the tail (crash mid-write) is cut off.
+    """
+
+    HEADER = struct.Struct("<II")
+
+    def __init__(self, directory: str, segment_bytes: int = NTFY_WAL_SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.committed = self._read_committed()
+        self.acked = set()
+        self.pending = []  # (offset, item) left unacknowledged by the previous run
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log"))
+        self.next_offset = self._recover()
+        self._commit_written = self.committed
+        self._dirty = False
+        if not self.segments or self.segments[-1] != self._segment_base:
+            self.segments.append(self._segment_base)
+        self._file = open(self._segment_path(self.segments[-1]), "ab")
+
+    def _segment_path(self, base: int) -> str:
+        return os.path.join(self.directory, f"{base:020d}.log")
+
+    def _read_committed(self) -> int:
+        try:
+            with open(os.path.join(self.directory, "committed"), "r", encoding="ascii") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _recover(self) -> int:
+        """Scan segments, collect unacknowledged records, and truncate a torn tail."""
+        offset = self.segments[0] if self.segments else self.committed
+        self._segment_base = offset
+        for base in self.segments:
+            offset, self._segment_base = base, base
+            path = self._segment_path(base)
+            size = os.path.getsize(path)
+            if size == 0:
+                continue
+            with open(path, "r+b") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                pos = 0
+                while pos + self.HEADER.size <= size:
+                    length, crc = self.HEADER.unpack_from(view, pos)
+                    end = pos + self.HEADER.size + length
+                    if end > size or zlib.crc32(view[pos + self.HEADER.size:end]) != crc:
+                        break
+                    if offset >= self.committed:
+                        self.pending.append((offset, json.loads(view[pos + self.HEADER.size:end])))
+                    offset += 1
+                    pos = end
+            if pos < size:
+                log("warn", f"⚠️ [WAL] Truncating torn tail of {os.path.basename(path)} at byte {pos}")
+                with open(path, "r+b") as f:
+                    f.truncate(pos)
+        return max(offset, self.committed)
+
+    def append(self, record: dict) -> int:
+        payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            if self._file.tell() >= self.segment_bytes:
+                self._roll()
+            offset = self.next_offset
+            self._file.write(self.HEADER.pack(len(payload), zlib.crc32(payload)))
+            self._file.write(payload)
+            self.next_offset += 1
+            self._dirty = True
+        return offset
+
+    def _roll(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self.segments.append(self.next_offset)
+        self._file = open(self._segment_path(self.next_offset), "ab")
+
+    def ack(self, offset: int):
+        if offset < self.committed:
+            return
+        self.acked.add(offset)
+        while self.committed in self.acked:
+            self.acked.discard(self.committed)
+            self.committed += 1
+
+    def sync(self):
+        """Group commit: one fsync for every append since the last call."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, False
+            if dirty:
+                self._file.flush()
+                # our own descriptor: _roll() may close the segment while we fsync
+                fileno = os.dup(self._file.fileno())
+            committed = self.committed
+        if dirty:
+            try:
+                os.fsync(fileno)
+            finally:
+                os.close(fileno)
+        if committed != self._commit_written:
+            path = os.path.join(self.directory, "committed")
+            with open(path + ".tmp", "w", encoding="ascii") as f:
+                f.write(str(committed))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            self._commit_written = committed
+            self._drop_consumed_segments(committed)
+
+    def _drop_consumed_segments(self, committed: int):
+        with self._lock:
+            while len(self.segments) > 1 and self.segments[1] <= committed:
+                base = self.segments.pop(0)
+                try:
+                    os.remove(self._segment_path(base))
+                except OSError:
+                    pass
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            self._file.close()
+
+ntfy_log = None
+
+def open_ntfy_log(directory: str = NTFY_WAL_DIR):
+    global ntfy_log
+    if directory and ntfy_log is None:
+        ntfy_log = NtfyLog(directory)
+        log("info", f"💾 [WAL] {directory}: committed offset {ntfy_log.committed}, {len(ntfy_log.pending)} to replay")
+    return ntfy_log
+
+async def replay_ntfy_log():
+    """Queue what the last run left unsent.
+
+    A sharded worker skips messages whose claim another worker has taken
+    over (and sent) while this one was down.
+    """
+    records, ntfy_log.pending = ntfy_log.pending, []
+    claims = [tuple(record["claim"]) for _, record in records if record.get("claim")]
+    owned = None
+    if claims and state_store is not None and shared_claims.worker:
+        owned = await run_blocking(state_store.owned, shared_claims.worker, claims)
+    for offset, record in records:
+        msg = ChatMessage.from_dict(record)
+        msg.offset = offset
+        if msg.claim is not None and owned is not None and msg.claim not in owned:
+            ntfy_log.ack(offset)
+            continue
+        if msg.claim is not None:
+            shared_claims.inflight[msg.claim] = owned[msg.claim]
+        ntfy_queue.put_nowait(msg)
+
+async def run_ntfy_log():
+    """Replay what the last run left unsent, then group-commit forever."""
+    await replay_ntfy_log()
+    try:
+        while True:
+            await asyncio.sleep(NTFY_WAL_COMMIT_INTERVAL)
+            try:
+                await run_blocking(ntfy_log.sync)
+            except Exception as e:
+                log("error", f"❌ [WAL] Group commit failed, retrying: {e}")
+    finally:
+        ntfy_log.sync()
+
+# =====================================================
+# --- Outbound Queue ---
+# =====================================================
+class OutboundQueue:
+    """Notification queue with one FIFO lane per topic and title, served round-robin.
+
+    Drop-in for the asyncio.Queue the sinks used (put_nowait/get/get_nowait/
+    empty/qsize/task_done), but a chat flood on one platform can no longer
+    starve the others. Lanes are deques, so every operation is O(1).
+    With NTFY_WAL_DIR set, every item is appended to the on-disk log when
+    queued and acknowledged through task_done(item) once it was sent.
+    """
+
+    def __init__(self):
+        self.lanes = OrderedDict()  # (topic, title) -> deque, next lane to serve first
+        self._size = 0
+        self._ready = asyncio.Event()
+
+    def put_nowait(self, item):
+        if item is not None and ntfy_log is not None and item.offset is None:
+            item.offset = ntfy_log.append(item.to_dict())
+        if item is not None:
+            item.mark("enqueued")
+        lane_key = (item.topic, item.platform) if item is not None else None
+        lane = self.lanes.get(lane_key)
+        if lane is None:
+            lane = self.lanes[lane_key] = deque()
+        lane.append(item)
+        self._size += 1
+        self._ready.set()
+
+    def get_nowait(self):
+        if not self._size:
+            raise asyncio.QueueEmpty
+        lane_key, lane = next(iter(self.lanes.items()))
+        item = lane.popleft()
+        del self.lanes[lane_key]
+        if lane:
+            self.lanes[lane_key] = lane  # rotate to the back
+        self._size -= 1
+        if item is not None:
+            item.mark("dequeued")
+        return item
+
+    async def get(self):
+        while not self._size:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.get_nowait()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return not self._size
+
+    def task_done(self, item=None):
+        if item is not None and ntfy_log is not None and item.offset is not None:
+            ntfy_log.ack(item.offset)
+        if item is not None and item.claim is not None:
+            shared_claims.done(item)
+        if item is not None and item.trace is not None:
+            message_traces.record(item)
 
 # =====================================================
 # --- Global Tracking ---
 # =====================================================
-ntfy_queue = Queue()
+ntfy_queue = OutboundQueue()
 last_ntfy_sent = 0
 
-fb_seen_comment_ids = set()
-kick_seen_ids = set()
-kick_queue = []
-yt_sent_messages = set()
+fb_seen_comment_ids = DedupCache()
+kick_seen_ids = DedupCache()
+yt_sent_messages = DedupCache()
+
+def attach_state_store(store):
+    """Share claimed IDs and cursors with other workers through `store` (see SharedClaims)."""
+    global state_store
+    state_store = store
+
+class SharedClaims:
+    """The cross-worker half of dedup, when a STATE_STORE is attached.
+
+    New messages wait here for at most STATE_STORE_COMMIT_INTERVAL. One
+    store transaction, run on the I/O pool, then claims the whole batch
+    and saves the cursors checkpointed meanwhile, so a saved cursor never
+    gets ahead of the claims for the messages it skips. Only won messages
+    go on to their sink (the ntfy queue). A claim stays pending in the
+    store until the message was sent: a worker taking over a stream
+    re-queues whatever its previous owner claimed but never sent.
+    Handing a stream over disowns its claims here first, and the senders
+    drop messages this worker no longer owns (owns()), so a claim is only
+    ever sent by the worker holding it.
+    """
+
+    def __init__(self):
+        self.worker = ""  # set by run_worker
+        self.claims = []  # (stream, msg, sink) waiting for the store
+        self.delivered = []  # (ns, key) sent since the last commit
+        self.cursors = {}  # (stream, platform) -> cursor state to save
+        self.inflight = {}  # (ns, key) claimed by this process and not sent yet -> stream name
+        self._wake = asyncio.Event()
+
+    def submit(self, stream, msg: ChatMessage, sink):
+        if state_store is None:
+            sink(msg)
+            return
+        self.claims.append((stream, msg, sink))
+        self._wake.set()
+
+    def owns(self, msg: ChatMessage) -> bool:
+        """False once the claim on `msg` went to another worker; send nothing then."""
+        return msg.claim is None or state_store is None or msg.claim in self.inflight
+
+    def done(self, msg: ChatMessage):
+        if msg.claim is not None and self.inflight.pop(msg.claim, None) is not None:
+            self.delivered.append(msg.claim)
+            self._wake.set()
+
+    def save_cursor(self, stream: str, platform: str, state: dict):
+        self.cursors[(stream, platform)] = state
+        self._wake.set()
+
+    async def flush(self):
+        claims, self.claims = self.claims, []
+        delivered, self.delivered = self.delivered, []
+        cursors, self.cursors = self.cursors, {}
+        if not (claims or delivered or cursors):
+            return
+        rows = [(msg.platform.lower(), stream.key(msg.id), stream.name, json.dumps(msg.to_dict()))
+                for stream, msg, _ in claims]
+        try:
+            won = await run_blocking(state_store.commit, self.worker, rows, delivered, cursors)
+        except Exception as e:
+            self.claims[:0] = claims
+            self.delivered[:0] = delivered
+            self.cursors = {**cursors, **self.cursors}
+            log("warn", f"⚠️ [State] Store commit failed, retrying: {e}")
+            return
+        for (_, msg, sink), row, ok in zip(claims, rows, won):
+            if ok:
+                msg.claim = row[:2]
+                self.inflight[msg.claim] = row[2]
+                sink(msg)
+            else:
+                deduped_total.inc(msg.platform)
+
+    async def adopt(self, stream) -> int:
+        """Queue what earlier owners of `stream` claimed and never sent."""
+        rows = await run_blocking(state_store.adopt, stream.name, self.worker)
+        for ns, key, message in rows:
+            msg = ChatMessage.from_dict(json.loads(message))
+            msg.claim = (ns, key)
+            self.inflight[msg.claim] = stream.name
+            ntfy_queue.put_nowait(msg)
+        return len(rows)
+
+    async def release(self, stream):
+        """Give up `stream`'s unsent claims; queued copies are dropped at send time."""
+        for claim in [claim for claim, name in self.inflight.items() if name == stream.name]:
+            del self.inflight[claim]
+        for _, msg in stream.yt_delivery_queue:
+            if ntfy_log is not None and msg.offset is not None:
+                ntfy_log.ack(msg.offset)
+        stream.yt_delivery_queue.clear()
+        await run_blocking(state_store.disown, self.worker, stream.name)
+
+    async def run(self):
+        try:
+            while True:
+                await self._wake.wait()
+                await asyncio.sleep(STATE_STORE_COMMIT_INTERVAL)
+                self._wake.clear()
+                await self.flush()
+        finally:
+            await self.flush()
+
+shared_claims = SharedClaims()
+
+async def run_shared_claims():
+    await shared_claims.run()
+
+# Shared by every configured stream; keys are prefixed with the stream name
+# per-user last message tracking
+kick_last_message_by_user = DedupCache(max_items=LAST_MESSAGE_MAX_USERS, bloom_capacity=0)
+yt_last_message_by_user = DedupCache(max_items=LAST_MESSAGE_MAX_USERS, bloom_capacity=0)
+fb_last_message_by_user = DedupCache(max_items=LAST_MESSAGE_MAX_USERS, bloom_capacity=0)
 
 kick_api = KickAPI()
+KICK_HOST = "kick.com"
+
+# =====================================================
+# --- Metrics ---
+# =====================================================
+# Prometheus text format, served at /metrics by fb_app. Counters and
+# histograms are only written from the engine loop, and a scrape reads
+# snapshots, so neither side takes a lock.
+METRICS = []
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values = {}  # label values -> count
+        METRICS.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, count in list(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {count}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        METRICS.append(self)
+
+    def observe(self, value: float, *label_values):
+        row = self.values.get(label_values)
+        if row is None:
+            row = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for values, row in list(self.values.items()):
+            row = list(row)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {row[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+class Gauge:
+    """Read at scrape time: `func` returns a number, or {label values: number}."""
+
+    def __init__(self, name: str, help: str, func, labels=()):
+        self.name, self.help, self.func, self.labels = name, help, func, tuple(labels)
+        METRICS.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.func()
+        except Exception:
+            return lines
+        for values, v in (value.items() if isinstance(value, dict) else [((), value)]):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {v}")
+        return lines
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+poll_seconds = Histogram("livechat_poll_duration_seconds", "Time spent in one platform poll.", ["platform"])
+ingested_total = Counter("livechat_messages_ingested_total", "New chat messages handed to ntfy.", ["platform"])
+deduped_total = Counter("livechat_messages_deduped_total", "Chat messages dropped as already seen.", ["platform"])
+api_errors_total = Counter("livechat_api_errors_total", "Platform and ntfy API errors.", ["platform", "reason"])
+ntfy_send_seconds = Histogram("livechat_ntfy_send_duration_seconds", "Latency of one ntfy POST.")
+ntfy_sent_total = Counter("livechat_ntfy_posts_total", "ntfy POSTs by outcome.", ["outcome"])
+ntfy_lag_seconds = Histogram("livechat_notification_lag_seconds", "Time from receiving a message to sending it.",
+                             ["platform"], buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900))
+ntfy_parts = Histogram("livechat_ntfy_parts_per_message", "Notifications a message was split into.",
+                       buckets=(1, 2, 3, 5, 10))
+Gauge("livechat_ntfy_queue_depth", "Messages waiting for the ntfy worker.", lambda: ntfy_queue.qsize())
+
+def api_error(platform: str, reason):
+    api_errors_total.inc(platform, reason or "unknown")
+
+# =====================================================
+# --- Tracing ---
+# =====================================================
+# A sampled message records when it passed each stage: created (platform
+# timestamp), fetched, deduped, enqueued, dequeued and every ntfy part sent.
+# It is written to TRACE_FILE once the ntfy worker is done with it;
+# `python main.py trace-report` summarises the file.
+TRACE_STAGES = ("created", "fetched", "deduped", "enqueued", "dequeued", "sent")
+
+class TraceWriter:
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self.lines = []
+
+    def record(self, msg: ChatMessage):
+        self.lines.append(json.dumps({"platform": msg.platform, "id": msg.id, "topic": msg.topic, **msg.trace}))
+
+    def flush(self):
+        lines, self.lines = self.lines, []
+        if lines:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+message_traces = TraceWriter()
+
+async def run_trace_writer():
+    try:
+        while True:
+            await asyncio.sleep(1)
+            await run_blocking(message_traces.flush)
+    finally:
+        message_traces.flush()
+
+def percentiles(values: list) -> str:
+    if not values:
+        return "-"
+    values = sorted(values)
+    pick = lambda q: values[int(q * (len(values) - 1))]
+    return f"p50 {pick(0.5):7.2f}s  p95 {pick(0.95):7.2f}s  p99 {pick(0.99):7.2f}s  max {values[-1]:7.2f}s"
+
+def trace_report(path: str = TRACE_FILE):
+    """Lag percentiles per platform: end to end, and between consecutive stages."""
+    by_platform = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                trace = json.loads(line)
+                by_platform.setdefault(trace.get("platform", "?"), []).append(trace)
+    for platform, traces in sorted(by_platform.items()):
+        print(f"📈 {platform}: {len(traces)} traced message(s)")
+        total = [t["sent"][-1] - t.get("created", t["fetched"]) for t in traces if t.get("sent")]
+        print(f"   {'end to end':<22}{percentiles(total)}")
+        for before, after in zip(TRACE_STAGES, TRACE_STAGES[1:]):
+            lags = []
+            for t in traces:
+                end = t.get(after)
+                if isinstance(end, list):
+                    end = end[0] if end else None
+                if t.get(before) is not None and end is not None:
+                    lags.append(end - t[before])
+            print(f"   {before + ' -> ' + after:<22}{percentiles(lags)}")
+        parts = [t["sent"][-1] - t["sent"][0] for t in traces if len(t.get("sent", [])) > 1]
+        if parts:
+            print(f"   {'first -> last part':<22}{percentiles(parts)}")
+        failed = sum(1 for t in traces if "failed" in t)
+        if failed:
+            print(f"   ⚠️ {failed} send failure(s)")
+
+# =====================================================
+# --- Chat Archive ---
+# =====================================================
+class ChatArchive:
+    """Every delivered chat message, in a SQLite file (WAL mode) with search indexes.
+
+    `add()` is all the hot path does: it appends a row to a deque. The
+    archive task writes whatever has accumulated in one transaction every
+    CHAT_ARCHIVE_FLUSH_INTERVAL, on the I/O pool. Text search uses FTS5
+    when the SQLite build has it, and LIKE otherwise. A "stream" in queries
+    is a run of a channel's messages with no gap over CHAT_ARCHIVE_SESSION_GAP.
+    """
+
+    COLUMNS = ("stream", "platform", "msg_id", "user", "text", "created", "ts")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = deque(maxlen=CHAT_ARCHIVE_MAX_PENDING)
+        self._pending_lock = threading.Lock()  # add() on the loop vs. flush() on the I/O pool; never held over I/O
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY, stream TEXT NOT NULL, platform TEXT NOT NULL, msg_id TEXT,
+                user TEXT NOT NULL, text TEXT NOT NULL, created TEXT, ts REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS messages_ts ON messages (ts);
+            CREATE INDEX IF NOT EXISTS messages_stream_ts ON messages (stream, ts);
+            CREATE INDEX IF NOT EXISTS messages_platform_ts ON messages (platform, ts);
+            CREATE INDEX IF NOT EXISTS messages_user_ts ON messages (user COLLATE NOCASE, ts);
+        """)
+        try:
+            self.db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+                END;
+            """)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def add(self, stream: str, msg: ChatMessage):
+        row = (stream, msg.platform, None if msg.id is None else str(msg.id), msg.user, msg.text, msg.created, time.time())
+        with self._pending_lock:
+            self.pending.append(row)
+
+    def flush(self) -> int:
+        with self._pending_lock:
+            rows = list(self.pending)
+            self.pending.clear()
+        if not rows:
+            return 0
+        with self._lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany(f"INSERT INTO messages ({', '.join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                with self._pending_lock:
+                    # back in front for the next flush; past the cap, the oldest of them go
+                    room = self.pending.maxlen - len(self.pending)
+                    self.pending.extendleft(reversed(rows[max(len(rows) - room, 0):]))
+                raise
+        return len(rows)
+
+    def last_stream_start(self, stream: str = None, platform: str = None) -> float:
+        """When the most recent stream (optionally of one channel/platform) started."""
+        where, params = self._filters(stream=stream, platform=platform)
+        with self._lock:
+            row = self.db.execute(
+                f"SELECT MAX(ts) FROM (SELECT ts, ts - LAG(ts) OVER (ORDER BY ts) AS gap FROM messages {where}) "
+                "WHERE gap IS NULL OR gap > ?", (*params, CHAT_ARCHIVE_SESSION_GAP)).fetchone()
+        return row[0] if row and row[0] is not None else 0.0
+
+    def _filters(self, stream=None, platform=None, user=None, since=None, until=None, text=None):
+        clauses, params = [], []
+        if stream:
+            clauses.append("stream = ?")
+            params.append(stream)
+        if platform:
+            clauses.append("platform = ? COLLATE NOCASE")
+            params.append(platform)
+        if user:
+            clauses.append("user = ? COLLATE NOCASE")
+            params.append(user)
+        if since:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until:
+            clauses.append("ts < ?")
+            params.append(until)
+        if text and self.fts:
+            clauses.append("id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            params.append(" ".join('"' + word.replace('"', '""') + '"' for word in text.split()))  # words, not FTS syntax
+        elif text:
+            clauses.append("text LIKE ?")
+            params.append(f"%{text}%")
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, stream=None, platform=None, user=None, since=None, until=None, text=None,
+              last_stream=False, limit=100) -> list:
+        """Matching messages, newest first, as dicts."""
+        if last_stream:
+            since = max(since or 0, self.last_stream_start(stream, platform))
+        where, params = self._filters(stream, platform, user, since, until, text)
+        with self._lock:
+            rows = self.db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM messages {where} ORDER BY ts DESC LIMIT ?",
+                                   (*params, limit)).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+chat_archive = None
+
+def open_chat_archive(path: str = CHAT_ARCHIVE):
+    global chat_archive
+    if path and chat_archive is None:
+        chat_archive = ChatArchive(path)
+    return chat_archive
+
+def archive_message(stream, msg: ChatMessage):
+    if chat_archive is not None:
+        chat_archive.add(stream.name, msg)
+
+async def run_chat_archive():
+    try:
+        while True:
+            await asyncio.sleep(CHAT_ARCHIVE_FLUSH_INTERVAL)
+            try:
+                await run_blocking(chat_archive.flush)
+            except Exception as e:
+                log("warn", f"⚠️ [Archive] Write failed, keeping rows for the next try: {e}")
+    finally:
+        chat_archive.flush()
+
+def parse_since(value: str) -> float:
+    """'90m', '2h', '3d' ago, or an ISO timestamp, as unix time."""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value and value[-1] in units and value[:-1].replace(".", "", 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    parsed = datetime.fromisoformat(value)
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+
+def archive_cli(args):
+    archive = ChatArchive(args.file)
+    rows = archive.query(stream=args.stream, platform=args.platform, user=args.user,
+                         since=parse_since(args.since) if args.since else None, text=args.search,
+                         last_stream=args.last_stream, limit=args.limit)
+    for row in reversed(rows):
+        if args.json:
+            print(json.dumps(row, ensure_ascii=False))
+        else:
+            when = datetime.fromtimestamp(row["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{when} [{row['platform']}/{row['stream']}] {row['user']}: {row['text']}")
+
+# =====================================================
+# --- Chat Analytics ---
+# =====================================================
+# Live stats per stream, updated as each message is ingested: a rolling
+# message rate per platform, the heaviest chatters and rate spikes. Every
+# structure has a fixed size and each message costs O(1); nothing is ever
+# recomputed from history. Served as JSON at /stats and, when
+# ANALYTICS_SUMMARY_INTERVAL is set, sent to each stream's ntfy topic.
+class SlidingCounter:
+    """Events in the last `window` seconds, kept in one-second slots."""
+
+    def __init__(self, window: int = ANALYTICS_WINDOW):
+        self.slots = [0] * max(1, window)
+        self.tick = 0  # the second the newest slot belongs to
+        self.total = 0
+
+    def _advance(self, now: float):
+        tick = int(now)
+        steps = tick - self.tick
+        if steps <= 0:
+            return
+        if steps >= len(self.slots):
+            self.slots = [0] * len(self.slots)
+            self.total = 0
+        else:
+            for i in range(self.tick + 1, tick + 1):
+                slot = i % len(self.slots)
+                self.total -= self.slots[slot]
+                self.slots[slot] = 0
+        self.tick = tick
+
+    def add(self, now: float, amount: int = 1):
+        self._advance(now)
+        self.slots[self.tick % len(self.slots)] += amount
+        self.total += amount
+
+    def per_minute(self, now: float) -> float:
+        # read-only, so /stats and /metrics can call it from a web thread
+        size = len(self.slots)
+        steps = int(now) - self.tick
+        if steps >= size:
+            return 0.0
+        expired = sum(self.slots[i % size] for i in range(self.tick + 1, self.tick + steps + 1))
+        return (self.total - expired) * 60 / size
+
+class SpaceSaving:
+    """Approximate top-k counts (Metwally et al.) in at most `capacity` entries.
+
+    Counts are kept in buckets of equal count, so an increment, and the
+    eviction of a least-counted entry to make room, are both O(1). An
+    entry's count overestimates its true count by at most its `error`.
+    """
+
+    def __init__(self, capacity: int = ANALYTICS_TOP_USERS):
+        self.capacity = max(1, capacity)
+        self.counts = {}  # item -> [count, error]
+        self.buckets = {}  # count -> {item: None}, insertion-ordered
+        self.min_count = 0
+
+    def _move(self, item, old: int, new: int):
+        if old:
+            bucket = self.buckets[old]
+            del bucket[item]
+            if not bucket:
+                del self.buckets[old]
+                if self.min_count == old:
+                    self.min_count = new
+        self.buckets.setdefault(new, {})[item] = None
+        if not old and (not self.min_count or new < self.min_count):
+            self.min_count = new
+
+    def add(self, item):
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] += 1
+            self._move(item, entry[0] - 1, entry[0])
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = [1, 0]
+            self._move(item, 0, 1)
+            return
+        floor = self.min_count
+        victim = next(iter(self.buckets[floor]))
+        del self.counts[victim]
+        self.counts[item] = [floor + 1, floor]
+        del self.buckets[floor][victim]
+        if not self.buckets[floor]:
+            del self.buckets[floor]
+            self.min_count = floor + 1
+        self.buckets.setdefault(floor + 1, {})[item] = None
+
+    def top(self, n: int = 10) -> list:
+        """The `n` largest entries as (item, count, error), biggest first."""
+        return sorted(((item, c, e) for item, (c, e) in list(self.counts.items())), key=lambda r: -r[1])[:n]
+
+class SpikeDetector:
+    """Flags buckets of ANALYTICS_SPIKE_BUCKET seconds that are far above normal.
+
+    "Normal" is an exponentially weighted mean and variance of earlier
+    bucket counts, so it follows a stream as it grows or quietens down.
+    """
+
+    WARMUP = 6  # buckets seen before anything can be a spike
+    MAX_IDLE_BUCKETS = 60  # empty buckets folded in after a silence; older ones no longer matter
+
+    def __init__(self, bucket=ANALYTICS_SPIKE_BUCKET, z=ANALYTICS_SPIKE_Z, minimum=ANALYTICS_SPIKE_MIN, alpha=0.1):
+        self.bucket, self.z, self.minimum, self.alpha = bucket, z, minimum, alpha
+        self.index = None  # bucket currently being counted
+        self.count = 0
+        self.flagged = False  # current bucket already reported
+        self.mean = 0.0
+        self.var = 0.0
+        self.seen = 0
+        self.spikes = deque(maxlen=10)  # (wall time, count, normal count)
+
+    def _close(self, count: int):
+        diff = count - self.mean
+        step = self.alpha * diff
+        self.mean += step
+        self.var = (1 - self.alpha) * (self.var + diff * step)
+        self.seen += 1
+
+    def add(self, now: float) -> bool:
+        """Count one message; True when it makes the current bucket a spike (once per bucket)."""
+        index = int(now // self.bucket)
+        if self.index is None:
+            self.index = index
+        elif index != self.index:
+            self._close(self.count)
+            for _ in range(min(index - self.index - 1, self.MAX_IDLE_BUCKETS)):
+                self._close(0)
+            self.index, self.count, self.flagged = index, 0, False
+        self.count += 1
+        if (self.flagged or self.seen < self.WARMUP or self.count < self.minimum
+                or self.count <= self.mean + self.z * math.sqrt(self.var)):
+            return False
+        self.flagged = True
+        self.spikes.append((time.time(), self.count, self.mean))
+        return True
+
+class StreamStats:
+    def __init__(self):
+        self.rates = {}  # platform -> SlidingCounter
+        self.totals = {}  # platform -> messages since start
+        self.chatters = SpaceSaving()
+        self.spikes = SpikeDetector()
+        self.summarised = 0  # messages counted in the last ntfy summary
+
+    def add(self, msg: ChatMessage, now: float) -> bool:
+        rate = self.rates.get(msg.platform)
+        if rate is None:
+            rate = self.rates[msg.platform] = SlidingCounter()
+        rate.add(now)
+        self.totals[msg.platform] = self.totals.get(msg.platform, 0) + 1
+        self.chatters.add((msg.platform, msg.user))
+        return self.spikes.add(now)
+
+    def snapshot(self, now: float, top: int = 10) -> dict:
+        rates = {platform: round(rate.per_minute(now), 1) for platform, rate in list(self.rates.items())}
+        return {
+            "messages_per_minute": {**rates, "total": round(sum(rates.values()), 1)},
+            "messages_total": dict(self.totals),
+            "top_chatters": [{"platform": platform, "user": user, "count": count, "error": error}
+                             for (platform, user), count, error in self.chatters.top(top)],
+            "spikes": {
+                "bucket_seconds": self.spikes.bucket,
+                "normal_per_bucket": round(self.spikes.mean, 1),
+                "current_bucket": self.spikes.count,
+                "recent": [{"at": datetime.fromtimestamp(at, timezone.utc).isoformat(timespec="seconds"),
+                            "count": count, "normal": round(normal, 1)}
+                           for at, count, normal in list(self.spikes.spikes)],
+            },
+        }
+
+class ChatAnalytics:
+    def __init__(self):
+        self.streams = {}  # stream name -> StreamStats
+
+    def observe(self, stream, msg: ChatMessage):
+        stats = self.streams.get(stream.name)
+        if stats is None:
+            stats = self.streams[stream.name] = StreamStats()
+        if stats.add(msg, time.monotonic()):
+            chat_spikes_total.inc(stream.name)
+            spike = stats.spikes.spikes[-1]
+            log("info", f"📈 [{stream.name}] Chat spike: {spike[1]}+ messages within {stats.spikes.bucket:g}s "
+                        f"(normally {spike[2]:.0f})")
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "generated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "window_seconds": ANALYTICS_WINDOW,
+            "streams": {name: stats.snapshot(now) for name, stats in list(self.streams.items())},
+        }
+
+chat_analytics = ChatAnalytics()
+chat_spikes_total = Counter("livechat_chat_spikes_total", "Chat rate spikes detected.", ["stream"])
+Gauge("livechat_chat_messages_per_minute", "Rolling chat rate over ANALYTICS_WINDOW.",
+      lambda: {(name, platform): rate.per_minute(time.monotonic())
+               for name, stats in list(chat_analytics.streams.items())
+               for platform, rate in list(stats.rates.items())},
+      labels=["stream", "platform"])
+
+def chat_summary(stats: StreamStats, now: float) -> str:
+    snap = stats.snapshot(now, top=5)
+    rates = snap["messages_per_minute"]
+    lines = [f"💬 {rates.pop('total'):g} msgs/min"
+             + (" (" + ", ".join(f"{p} {r:g}" for p, r in rates.items()) + ")" if len(rates) > 1 else "")]
+    if snap["top_chatters"]:
+        lines.append("🏆 " + ", ".join(f"{c['user']} ({c['platform']}) {c['count']}" for c in snap["top_chatters"]))
+    since = time.time() - ANALYTICS_SUMMARY_INTERVAL
+    recent = [(at, count) for at, count, _ in list(stats.spikes.spikes) if at > since]
+    if recent:
+        lines.append("📈 Spikes: " + ", ".join(
+            f"{datetime.fromtimestamp(at, timezone.utc):%H:%M} UTC ({count}+ msgs)" for at, count in recent))
+    return "\n".join(lines)
+
+async def run_chat_summary():
+    """Send each active stream's chat stats to its ntfy topic every ANALYTICS_SUMMARY_INTERVAL."""
+    while True:
+        await asyncio.sleep(ANALYTICS_SUMMARY_INTERVAL)
+        for stream in STREAMS:
+            stats = chat_analytics.streams.get(stream.name)
+            if stats is None:
+                continue
+            total = sum(stats.totals.values())
+            if total == stats.summarised:
+                continue  # nothing new since the last summary
+            stats.summarised = total
+            try:
+                await post_ntfy(chat_summary(stats, time.monotonic()), stream.label("Chat summary"), stream.ntfy_topic)
+            except Exception as e:
+                log("warn", f"⚠️ [{stream.name}] Chat summary not sent: {e}")
+
+# =====================================================
+# --- Chat Rules ---
+# =====================================================
+# Decides which ingested messages are notified, between the listeners and
+# ntfy_queue. Every keyword of a rule set (include, exclude and mentions)
+# lives in one Aho-Corasick automaton and every regex in one alternation,
+# so a message is read once by each whatever the number of rules.
+class KeywordAutomaton:
+    """Aho-Corasick over case-folded keywords, matching whole words only.
+
+    Failure links are folded into the transition table when it is built, so
+    the scan is a single dict lookup per character.
+    """
+
+    def __init__(self, keywords: dict):
+        goto = [{}]  # state -> {char: state}, the keyword trie
+        self.out = [()]  # state -> ((keyword length, tag), ...) ending here
+        for keyword, tags in keywords.items():
+            state = 0
+            for ch in keyword:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    self.out.append(())
+                state = nxt
+            self.out[state] += tuple((len(keyword), tag) for tag in tags)
+
+        # breadth-first, so a state's failure target is complete before its children need it
+        fail = [0] * len(goto)
+        self.delta = [dict(goto[0])] + [None] * (len(goto) - 1)  # state -> {char: next state}, 0 omitted
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self.out[state] += self.out[fail[state]]
+            self.delta[state] = {**self.delta[fail[state]], **goto[state]}
+            for ch, nxt in goto[state].items():
+                fail[nxt] = self.delta[fail[state]].get(ch, 0)
+                queue.append(nxt)
+
+    def tags(self, text: str) -> set:
+        """Tags of every keyword found in `text` (already case-folded) as a whole word."""
+        delta, out = self.delta, self.out
+        found = set()
+        state = 0
+        last = len(text) - 1
+        for i, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if out[state] and (i == last or not text[i + 1].isalnum()):
+                for length, tag in out[state]:
+                    if i < length or not text[i - length].isalnum():
+                        found.add(tag)
+        return found
+
+class RuleSet:
+    """One stream's rules; see rules.example.json for the keys.
+
+    Denied users are dropped and allowed users always pass. Otherwise an
+    exclude keyword or regex drops the message, a mention of the streamer
+    passes it (to `mention_topic` when set), and if any include keyword or
+    regex is configured, only messages matching one of them pass. Keywords
+    and patterns are case-insensitive; use (?-i:...) for a case-sensitive part.
+    """
+
+    KEYS = ("allow_users", "deny_users", "include", "exclude", "mentions", "include_regex", "exclude_regex",
+            "mention_topic")
+
+    def __init__(self, config: dict):
+        unknown = set(config) - set(self.KEYS)
+        if unknown:
+            raise ValueError(f"Unknown rule key(s): {', '.join(sorted(unknown))}")
+        self.allow_users = {u.casefold() for u in config.get("allow_users", [])}
+        self.deny_users = {u.casefold() for u in config.get("deny_users", [])}
+        self.mention_topic = config.get("mention_topic")
+
+        keywords = {}
+        for tag in ("include", "exclude", "mentions"):
+            for keyword in config.get(tag, []):
+                keyword = keyword.casefold().lstrip("@") if tag == "mentions" else keyword.casefold()
+                if keyword:
+                    keywords.setdefault(keyword, set()).add(tag)
+        self.keywords = KeywordAutomaton(keywords) if keywords else None
+
+        # one pattern per kind: in a single alternation an include match could
+        # consume text an overlapping exclude pattern needed
+        self.include_pattern = self._combine("include_regex", config.get("include_regex", []))
+        self.exclude_pattern = self._combine("exclude_regex", config.get("exclude_regex", []))
+        self.needs_match = bool(config.get("include") or config.get("include_regex"))
+
+    @staticmethod
+    def _combine(tag: str, patterns: list):
+        for pattern in patterns:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"Bad {tag} pattern {pattern!r}: {e}") from None
+            if re.search(r"\\[1-9]|\(\?P=", pattern):  # group numbers shift once the patterns are joined
+                raise ValueError(f"Backreferences are not supported in rules: {pattern!r}")
+        if not patterns:
+            return None
+        try:
+            return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+        except re.error as e:  # e.g. a global (?i) flag, which only works at the start of the joined pattern
+            raise ValueError(f"Rule patterns cannot be combined: {e}") from None
+
+    def check(self, msg: ChatMessage):
+        """(reason the message is dropped or None, ntfy topic to use instead or None)."""
+        user = msg.user.casefold()
+        if user in self.deny_users:
+            return "deny_user", None
+        if user in self.allow_users:
+            return None, None
+        tags = self.keywords.tags(msg.text.casefold()) if self.keywords else set()
+        if "exclude" in tags or (self.exclude_pattern is not None and self.exclude_pattern.search(msg.text)):
+            return "exclude", None
+        if "mentions" in tags:
+            return None, self.mention_topic
+        if (self.needs_match and "include" not in tags
+                and not (self.include_pattern is not None and self.include_pattern.search(msg.text))):
+            return "no_match", None
+        return None, None
+
+def load_rules(path: str = RULES_FILE) -> dict:
+    """Stream name -> RuleSet; "*" holds the rules for streams without their own.
+
+    The file is one rule set, optionally with a "streams" object of per-stream
+    rule sets that replace it for those streams.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    per_stream = config.pop("streams", {})
+    rules = {name: RuleSet(entry) for name, entry in per_stream.items()}
+    if config:
+        rules["*"] = RuleSet(config)
+    log("info", f"🧹 Loaded chat rules from {path}")
+    return rules
+
+def attach_rules(streams, rules: dict):
+    for stream in streams:
+        stream.rules = rules.get(stream.name, rules.get("*"))
+
+filtered_total = Counter("livechat_messages_filtered_total", "Chat messages the rules kept from ntfy.",
+                         ["platform", "reason"])
+
+def route_message(stream, msg: ChatMessage) -> bool:
+    """Apply the stream's rules and set the message's ntfy topic; False drops it."""
+    msg.topic = stream.ntfy_topic
+    if stream.rules is None:
+        return True
+    reason, topic = stream.rules.check(msg)
+    if reason:
+        filtered_total.inc(msg.platform, reason)
+        return False
+    if topic:
+        msg.topic = topic
+    return True
+
+# =====================================================
+# --- Async Engine ---
+# =====================================================
+# All listeners run as coroutines on one event loop. The HTTP clients we use
+# (requests, kickapi) are blocking, so their calls are pushed onto one small
+# shared pool instead of parking a whole thread per source.
+io_executor = ThreadPoolExecutor(max_workers=ENGINE_IO_WORKERS, thread_name_prefix="io")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the shared I/O pool without stalling the loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+# =====================================================
+# --- HTTP Session Pool ---
+# =====================================================
+class HostPool:
+    """One keep-alive session per host, with a cap on concurrent calls to it."""
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, concurrency=HTTP_HOST_CONCURRENCY):
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.sessions = {}
+        self.limits = {}
+        self._lock = threading.Lock()
+
+    def session(self, host: str) -> requests.Session:
+        with self._lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self.sessions[host] = session
+            return session
+
+    def adopt(self, host: str, session: requests.Session):
+        """Track a session owned by a client library (e.g. kickapi) under this pool."""
+        with self._lock:
+            self.sessions[host] = session
+
+    def _limit(self, host: str) -> asyncio.Semaphore:
+        limit = self.limits.get(host)
+        if limit is None:
+            limit = self.limits[host] = asyncio.Semaphore(self.concurrency)
+        return limit
+
+    async def call(self, host: str, func, *args, **kwargs):
+        """Run a blocking call that talks to `host`, within that host's limit."""
+        async with self._limit(host):
+            return await run_blocking(func, *args, **kwargs)
+
+    async def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        host = urlsplit(url).netloc
+        return await self.call(host, self.session(host).request, method, url, **kwargs)
+
+    def stats(self) -> dict:
+        """Per host: requests sent, TCP/TLS connections opened, and reused requests."""
+        out = {}
+        with self._lock:
+            sessions = list(self.sessions.items())
+        for host, session in sessions:
+            sent = opened = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        sent += pool.num_requests
+                        opened += pool.num_connections
+            out[host] = {"requests": sent, "connections": opened, "reused": max(sent - opened, 0)}
+        return out
+
+http_pool = HostPool()
+http_pool.adopt(KICK_HOST, kick_api.session)
+
+async def get_json(url, **kwargs):
+    res = await http_pool.request("GET", url, **kwargs)
+    return res.json()
+
+async def report_http_stats():
+    if HTTP_STATS_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(HTTP_STATS_INTERVAL)
+        for host, st in http_pool.stats().items():
+            log("info", f"🔌 [HTTP] {host}: {st['requests']} requests over {st['connections']} connections ({st['reused']} reused)")
 
 # =====================================================
 # --- NTFY Worker ---
 # =====================================================
-MAX_SHORT_MSG_LEN = 123  # NTFY short message limit
+MAX_SHORT_MSG_LEN = 123  # NTFY short message limit, in UTF-8 bytes
+LONG_WORD_WRAP = 30  # grapheme clusters between zero-width spaces in very long words
+ZWSP = "\u200B"
+
+# Grapheme clusters, approximated with the stdlib: a base character (or a
+# flag pair) plus combining marks, variation selectors, skin tones and tag
+# characters, chained through zero-width joiners.
+_GRAPHEME_EXTEND = ("\u0300-\u036F\u0483-\u0489\u0591-\u05BD\u0610-\u061A\u064B-\u065F"
+                    "\u0900-\u0903\u093A-\u094F\u0E31\u0E34-\u0E3A\u0E47-\u0E4E\u1AB0-\u1AFF"
+                    "\u1DC0-\u1DFF\u200C\u20D0-\u20FF\uFE00-\uFE0F\uFE20-\uFE2F"
+                    "\U0001F3FB-\U0001F3FF\U000E0020-\U000E007F\U000E0100-\U000E01EF")
+GRAPHEME = re.compile(rf"(?:[\U0001F1E6-\U0001F1FF]{{2}}|.)[{_GRAPHEME_EXTEND}]*"
+                      rf"(?:\u200D.[{_GRAPHEME_EXTEND}]*)*", re.S)
+
+def utf8_len(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+class MessageFormatter:
+    """Flatten chat text onto one line and cut it into UTF-8 byte budgets.
+
+    One pass over the words: any run of whitespace becomes a single space,
+    words longer than `wrap` grapheme clusters get a zero-width space every
+    `wrap` clusters so ntfy can wrap them, and a part is closed as soon as
+    the next word would take it past `max_bytes` (None = never split).
+    Words are only ever cut between grapheme clusters, so emoji sequences
+    and accented letters stay whole (a lone cluster over the budget becomes
+    a part of its own rather than being broken).
+    """
+
+    def __init__(self, max_bytes: int = MAX_SHORT_MSG_LEN, wrap: int = LONG_WORD_WRAP):
+        self.max_bytes = max_bytes
+        self.wrap = wrap
+
+    def _tokens(self, word: str):
+        """Yield (token, size, joiner) for one word; long words come out in chunks."""
+        if len(word) <= self.wrap:  # never more clusters than code points
+            size = utf8_len(word)
+            if self.max_bytes is None or size <= self.max_bytes:
+                yield word, size, " "
+                return
+        if word.isascii():  # one byte and one cluster per character
+            step = self.wrap if self.max_bytes is None else min(self.wrap, self.max_bytes)
+            for i in range(0, len(word), step):
+                yield word[i:i + step], min(step, len(word) - i), " " if i == 0 else ZWSP
+            return
+        joiner, chunk, chunk_size, count = " ", [], 0, 0
+        for match in GRAPHEME.finditer(word):
+            cluster = match.group()
+            cluster_size = utf8_len(cluster)
+            if chunk and (count == self.wrap or
+                          (self.max_bytes is not None and chunk_size + cluster_size > self.max_bytes)):
+                yield "".join(chunk), chunk_size, joiner
+                joiner, chunk, chunk_size, count = ZWSP, [], 0, 0
+            chunk.append(cluster)
+            chunk_size += cluster_size
+            count += 1
+        if chunk:
+            yield "".join(chunk), chunk_size, joiner
+
+    def parts(self, text: str) -> list:
+        """The formatted text as (part, size in bytes) pairs."""
+        words = text.split()
+        if not words:
+            return []
+        if max(map(len, words)) <= self.wrap:
+            # common case: nothing to wrap, and often nothing to split either
+            flat = " ".join(words)
+            size = utf8_len(flat)
+            if self.max_bytes is None or size <= self.max_bytes:
+                return [(flat, size)]
+        parts, current, used = [], [], 0
+        for word in words:
+            for token, size, joiner in self._tokens(word):
+                if current:
+                    joined = used + (1 if joiner == " " else 3) + size
+                    if self.max_bytes is None or joined <= self.max_bytes:
+                        current += (joiner, token)
+                        used = joined
+                        continue
+                    parts.append(("".join(current), used))
+                current, used = [token], size
+        if current:
+            parts.append(("".join(current), used))
+        return parts
+
+    def format(self, text: str) -> list:
+        return [part for part, _ in self.parts(text)]
+
+    def batch(self, texts) -> list:
+        """parts() for many messages at once, in order."""
+        return [self.parts(text) for text in texts]
+
+ntfy_formatter = MessageFormatter()
 
 def clean_single_line(msg: str) -> str:
-    flat = " ".join(msg.replace("\n", " ").replace("\r", " ").split())
-    fixed_words = []
-    for word in flat.split():
-        if len(word) > 30:
-            chunks = [word[i:i+30] for i in range(0, len(word), 30)]
-            fixed_words.append("\u200B".join(chunks))
-        else:
-            fixed_words.append(word)
-    return " ".join(fixed_words)
+    return "".join(part for part, _ in MessageFormatter(max_bytes=None).parts(msg))
 
 def split_message(text, max_len=MAX_SHORT_MSG_LEN):
-    """Split text into parts, each not exceeding max_len."""
-    parts = []
-    while len(text) > max_len:
-        split_at = text.rfind(" ", 0, max_len)
-        if split_at == -1:
-            split_at = max_len
-        parts.append(text[:split_at].strip())
-        text = text[split_at:].strip()
-    if text:
-        parts.append(text)
-    return parts
-
-def ntfy_worker():
+    """Split text into parts, each not exceeding max_len bytes."""
+    return MessageFormatter(max_len).format(text)
+
+async def post_ntfy(body: str, title: str, topic: str = NTFY_TOPIC):
+    started = time.monotonic()
+    try:
+        res = await http_pool.request("POST", f"https://ntfy.sh/{topic}",
+                                data=body.encode("utf-8"),
+                                headers={"Title": title},
+                                timeout=5)
+        res.raise_for_status()
+    except Exception as e:
+        ntfy_sent_total.inc("error")
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        api_error("ntfy", f"http_{status}" if status else type(e).__name__)
+        raise
+    finally:
+        ntfy_send_seconds.observe(time.monotonic() - started)
+    ntfy_sent_total.inc("ok")
+
+async def ntfy_worker():
     global last_ntfy_sent
     while True:
-        msg_obj = ntfy_queue.get()
+        msg_obj = await ntfy_queue.get()
         if msg_obj is None:
             break
+        if not shared_claims.owns(msg_obj):  # its stream went to another worker, which sends it
+            ntfy_queue.task_done(msg_obj)
+            continue
         try:
             now = time.time()
-            if now - last_ntfy_sent < 5:
-                time.sleep(5 - (now - last_ntfy_sent))
-
-            title = msg_obj.get("title", "Chat")
-            user = msg_obj.get("user", "Unknown")
-            msg = msg_obj.get("msg", "")
-            clean_msg = clean_single_line(msg)
-            body = f"{user}: {clean_msg}"
-
-            # Send in chunks if message exceeds MAX_SHORT_MSG_LEN
-            if len(body) <= MAX_SHORT_MSG_LEN:
-                requests.post(f"https://ntfy.sh/{NTFY_TOPIC}",
-                              data=body.encode("utf-8"),
-                              headers={"Title": title},
-                              timeout=5)
-            else:
-                parts = split_message(body, MAX_SHORT_MSG_LEN)
-                for i, part in enumerate(parts, 1):
-                    part_title = f"{title} [{i}/{len(parts)}]" if len(parts) > 1 else title
-                    requests.post(f"https://ntfy.sh/{NTFY_TOPIC}",
-                                  data=part.encode("utf-8"),
-                                  headers={"Title": part_title},
-                                  timeout=5)
-                    if i < len(parts):
-                        time.sleep(3)
+            if now - last_ntfy_sent < MESSAGE_DELAY:
+                await asyncio.sleep(MESSAGE_DELAY - (now - last_ntfy_sent))
+
+            title = msg_obj.platform
+            topic = msg_obj.topic or NTFY_TOPIC
+
+            # Send in chunks if message exceeds MAX_SHORT_MSG_LEN bytes
+            parts = ntfy_formatter.format(f"{msg_obj.user}: {msg_obj.text}")
+            ntfy_parts.observe(len(parts))
+            for i, part in enumerate(parts, 1):
+                part_title = f"{title} [{i}/{len(parts)}]" if len(parts) > 1 else title
+                await post_ntfy(part, part_title, topic)
+                msg_obj.mark_sent()
+                if i < len(parts):
+                    await asyncio.sleep(3)
 
             last_ntfy_sent = time.time()
+            ntfy_lag_seconds.observe(time.monotonic() - msg_obj.received, msg_obj.platform)
 
         except Exception as e:
-            print("⚠️ Failed to send NTFY:", e)
+            log("warn", f"⚠️ Failed to send NTFY: {e}")
+            msg_obj.mark("failed")
+
+        ntfy_queue.task_done(msg_obj)
+
+
+class NtfyBatcher:
+    """Coalesce queued chat lines into one notification per platform.
+
+    Lines are grouped by topic and title and packed up to NTFY_BATCH_MAX_BYTES. The
+    gap between sends adapts to how fast chat is arriving: roughly the time
+    it takes to fill one payload, clamped to [min_interval, max_interval].
+    The rate is bytes over wall-clock time, sampled at every flush and
+    halved for every max_interval of silence, so a lull stretches the gap
+    back out. A full payload is sent straight away. A payload ntfy refused
+    goes back to the front of its group and is retried after a backoff.
+    """
+
+    def __init__(self, max_bytes=NTFY_BATCH_MAX_BYTES,
+                 min_interval=NTFY_BATCH_MIN_INTERVAL, max_interval=NTFY_BATCH_MAX_INTERVAL):
+        self.max_bytes = max_bytes
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.formatter = MessageFormatter(max_bytes)
+        self.pending = {}  # (topic, title) -> deque of (line, size, msg_obj, last part?), in arrival order
+        self.pending_bytes = {}  # (topic, title) -> encoded size incl. newlines
+        self.byte_rate = 0.0  # EWMA of incoming bytes/second, sampled at each flush
+        self.rated_at = time.monotonic()  # start of the current sampling window
+        self.arrived = 0  # bytes added since rated_at
+        self.last_sent = 0.0
+        self.failures = 0  # consecutive flushes with a failed post
+        self.retry_at = 0.0
+
+    def rate(self, now: float) -> float:
+        """Incoming bytes/second: the decayed EWMA, or the current window if that is faster."""
+        elapsed = now - self.rated_at
+        decayed = self.byte_rate * 0.5 ** (elapsed / self.max_interval)
+        return max(decayed, self.arrived / max(elapsed, self.min_interval))
+
+    def interval(self) -> float:
+        byte_rate = self.rate(time.monotonic())
+        if byte_rate <= 0:
+            return self.max_interval
+        fill_time = self.max_bytes / byte_rate
+        return min(self.max_interval, max(self.min_interval, fill_time))
+
+    def add_many(self, msg_objs: list):
+        texts = (f"{msg_obj.user}: {msg_obj.text}" for msg_obj in msg_objs)
+        for msg_obj, parts in zip(msg_objs, self.formatter.batch(texts)):
+            self.add(msg_obj, parts)
+
+    def add(self, msg_obj: ChatMessage, parts: list = None):
+        group_key = (msg_obj.topic or NTFY_TOPIC, msg_obj.platform)
+        if parts is None:
+            parts = self.formatter.parts(f"{msg_obj.user}: {msg_obj.text}")
+        ntfy_parts.observe(len(parts))
+        size = 0
+        group = self.pending.setdefault(group_key, deque())
+        for i, (part, part_size) in enumerate(parts):
+            # the message is done once its last part has gone out
+            group.append((part, part_size, msg_obj, i == len(parts) - 1))
+            size += part_size + 1
+        self.pending_bytes[group_key] = self.pending_bytes.get(group_key, 0) + size
+        self.arrived += size
+
+    def due(self) -> float:
+        """Seconds until the next flush (0 = now, None = nothing pending)."""
+        if not self.pending:
+            return None
+        now = time.monotonic()
+        if now < self.retry_at:
+            return self.retry_at - now
+        if any(size >= self.max_bytes for size in self.pending_bytes.values()):
+            return 0
+        return max(0.0, self.last_sent + self.interval() - now)
 
-        ntfy_queue.task_done()
+    def take(self):
+        """Pop one payload per topic and platform, as (group key, title, body, done, lines)."""
+        now = time.monotonic()
+        elapsed = max(now - self.rated_at, self.min_interval)
+        self.byte_rate = 0.8 * self.byte_rate * 0.5 ** (elapsed / self.max_interval) + 0.2 * self.arrived / elapsed
+        self.rated_at, self.arrived = now, 0
+
+        payloads = []
+        for group_key in list(self.pending):
+            title = group_key[1]
+            lines = self.pending[group_key]
+            body, done, taken, size, removed, count = [], [], [], 0, 0, 0
+            while lines:
+                line_size = lines[0][1] + 1
+                if body and size + line_size > self.max_bytes:
+                    break
+                entry = lines.popleft()
+                line, _, msg_obj, last = entry
+                removed += line_size
+                if not shared_claims.owns(msg_obj):  # its stream went to another worker, which sends it
+                    if last:
+                        ntfy_queue.task_done(msg_obj)
+                    continue
+                body.append(line)
+                taken.append(entry)
+                if last:
+                    done.append(msg_obj)
+                size += line_size
+                count += 1
+            if lines:
+                self.pending_bytes[group_key] -= removed
+            else:
+                del self.pending[group_key]
+                del self.pending_bytes[group_key]
+            if body:
+                payloads.append((group_key, f"{title} ({count})" if count > 1 else title, "\n".join(body), done, taken))
+        self.last_sent = now
+        return payloads
+
+    def put_back(self, group_key, lines: list):
+        """Return a payload that could not be sent to the front of its group."""
+        group = self.pending.setdefault(group_key, deque())
+        group.extendleft(reversed(lines))
+        self.pending_bytes[group_key] = self.pending_bytes.get(group_key, 0) + sum(size + 1 for _, size, _, _ in lines)
+
+    async def run(self):
+        while True:
+            timeout = self.due()
+            if timeout != 0:
+                try:
+                    msg_obj = await asyncio.wait_for(ntfy_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    msg_obj = False
+                if msg_obj is None:
+                    break
+                drained = [msg_obj] if msg_obj else []
+                while not ntfy_queue.empty():
+                    msg_obj = ntfy_queue.get_nowait()
+                    if msg_obj is None:
+                        self.add_many(drained)
+                        return
+                    drained.append(msg_obj)
+                self.add_many(drained)
+                if self.due() != 0:
+                    continue
+            failed = False
+            for group_key, title, body, done, lines in self.take():
+                try:
+                    await post_ntfy(body, title, group_key[0])
+                except Exception as e:
+                    failed = True
+                    self.put_back(group_key, lines)
+                    for msg_obj in done:
+                        msg_obj.mark("failed")
+                    log("warn", f"⚠️ Failed to send NTFY, keeping {len(done)} message(s) for a retry: {e}")
+                    continue
+                sent = time.monotonic()
+                for msg_obj in done:
+                    msg_obj.mark_sent()
+                    ntfy_lag_seconds.observe(sent - msg_obj.received, msg_obj.platform)
+                    ntfy_queue.task_done(msg_obj)
+            # back off while ntfy is failing or rate limiting (429), up to 5 minutes
+            self.failures = self.failures + 1 if failed else 0
+            self.retry_at = time.monotonic() + min(self.max_interval * 2 ** self.failures, 300) if failed else 0.0
+
+async def ntfy_batch_worker():
+    await NtfyBatcher().run()
 
 
 # =====================================================
@@ -120,21 +2020,26 @@ def ntfy_worker():
 # =====================================================
 GRAPH = "https://graph.facebook.com/v20.0"
 
-def safe_request(url, params):
+async def safe_request(url, params):
     try:
-        res = requests.get(url, params=params, timeout=10)
-        data = res.json()
+        data = await get_json(url, params=params, timeout=10)
         if "error" in data:
-            print(f"⚠️ [Facebook] API Error: {json.dumps(data, indent=2)}")
+            log("warn", "⚠️ [Facebook] API Error: {error}", error=data)
+            api_error("Facebook", fb_error_reason(data["error"]))
             return {}
         return data
     except Exception as e:
-        print(f"❌ [Facebook] Request failed: {e}")
+        log("error", f"❌ [Facebook] Request failed: {e}")
+        api_error("Facebook", type(e).__name__)
         return {}
 
-def refresh_fb_token():
-    global FB_PAGE_TOKEN
-    if not FB_PAGE_TOKEN:
+def fb_error_reason(err) -> str:
+    if not isinstance(err, dict):
+        return "unknown"
+    return err.get("type") or f"code_{err.get('code')}"
+
+async def refresh_fb_token(stream):
+    if not stream.fb_page_token:
         return
     try:
         url = f"{GRAPH}/oauth/access_token"
@@ -142,289 +2047,1246 @@ def refresh_fb_token():
             "grant_type": "fb_exchange_token",
             "client_id": FB_APP_ID,
             "client_secret": FB_APP_SECRET,
-            "fb_exchange_token": FB_PAGE_TOKEN,
+            "fb_exchange_token": stream.fb_page_token,
         }
-        res = requests.get(url, params=params).json()
+        res = await get_json(url, params=params)
         if "access_token" in res:
-            FB_PAGE_TOKEN = res["access_token"]
-            print("✅ [Facebook] Page access token refreshed!")
+            stream.fb_page_token = res["access_token"]
+            log("info", f"✅ [{stream.label('Facebook')}] Page access token refreshed!")
     except Exception as e:
-        print("❌ [Facebook] Failed to refresh token:", e)
+        log("error", f"❌ [{stream.label('Facebook')}] Failed to refresh token: {e}")
 
-def get_live_video():
-    url = f"{GRAPH}/{FB_PAGE_ID}/videos"
-    params = {"fields": "id,description,live_status,created_time","access_token": FB_PAGE_TOKEN,"limit": 10}
-    res = safe_request(url, params).get("data", [])
+async def get_live_video(stream):
+    url = f"{GRAPH}/{stream.fb_page_id}/videos"
+    params = {"fields": "id,post_id,description,live_status,created_time","access_token": stream.fb_page_token,"limit": 10}
+    res = (await safe_request(url, params)).get("data", [])
     for v in res:
         if v.get("live_status") == "LIVE":
-            print(f"🎯 [Facebook] Live video detected: {v['id']} | {v.get('description', '(no desc)')}")
+            log("info", f"🎯 [{stream.label('Facebook')}] Live video detected: {v['id']} | {v.get('description', '(no desc)')}")
+            # webhook comments name the post as "<page>_<post>"; a video's post usually shares its ID
+            posts = {f"{stream.fb_page_id}_{v['id']}"}
+            if v.get("post_id"):
+                post = str(v["post_id"])
+                posts.add(post if "_" in post else f"{stream.fb_page_id}_{post}")
+            stream.fb_live_posts = frozenset(posts)
             return v["id"]
     return None
 
-def fetch_new_comments(video_id):
+async def graph_batch(relative_urls: list, access_token: str) -> list:
+    """Run several Graph GETs in one HTTP round trip; failed entries come back as {}."""
+    batch = [{"method": "GET", "relative_url": url} for url in relative_urls]
+    try:
+        res = await http_pool.request("POST", GRAPH, data={"access_token": access_token, "batch": json.dumps(batch)},
+                                      timeout=10)
+        replies = res.json()
+    except Exception as e:
+        log("error", f"❌ [Facebook] Batch request failed: {e}")
+        api_error("Facebook", type(e).__name__)
+        return [{} for _ in relative_urls]
+    if not isinstance(replies, list):
+        log("warn", "⚠️ [Facebook] API Error: {error}", error=replies)
+        api_error("Facebook", fb_error_reason(replies.get("error") if isinstance(replies, dict) else None))
+        return [{} for _ in relative_urls]
+    out = []
+    for reply in replies:
+        try:
+            body = json.loads((reply or {}).get("body") or "{}")
+        except ValueError:
+            body = {}
+        if "error" in body:
+            log("warn", "⚠️ [Facebook] API Error: {error}", error=body)
+            api_error("Facebook", fb_error_reason(body["error"]))
+            body = {}
+        out.append(body)
+    return out
+
+def parse_fb_time(value: str):
+    try:
+        return int(datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").timestamp())
+    except (TypeError, ValueError):
+        return None
+
+class FacebookCommentCursor:
+    """Where the next comment fetch resumes on the current live video.
+
+    Comments are read in chronological order. Normally we continue from the
+    `after` cursor of the last page seen; if Graph rejects that cursor we
+    fall back to `since` = newest created_time seen (dedup removes the
+    one-second overlap).
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, video_id=None):
+        self.video_id = video_id
+        self.after = None
+        self.since = None
+
+    def to_state(self) -> dict:
+        return {"video_id": self.video_id, "after": self.after, "since": self.since}
+
+    def load_state(self, state: dict):
+        self.video_id, self.after, self.since = state.get("video_id"), state.get("after"), state.get("since")
+
+    def params(self) -> dict:
+        params = {"fields": "id,from{name},message,created_time", "order": "chronological",
+                  "filter": "stream", "limit": FB_COMMENTS_PAGE_SIZE}
+        if self.after:
+            params["after"] = self.after
+        else:
+            params["since"] = self.since or int(time.time()) - FB_INITIAL_LOOKBACK
+        return params
+
+def fb_comment(c: dict) -> ChatMessage:
+    """Parse a Graph comment (`id,from{name},message,created_time`)."""
+    msg = ChatMessage("Facebook", c.get("id"), (c.get("from") or {}).get("name", "Unknown"),
+                      c.get("message", ""), c.get("created_time") or "")
+    created = parse_fb_time(msg.created) if msg.trace is not None else None
+    if created:
+        msg.mark("created", created)
+    return msg
+
+def is_new_fb_comment(stream, msg: ChatMessage) -> bool:
+    """Dedup shared by the poller and the webhook; marks the comment as seen."""
+    user_key = stream.key(msg.user)
+    if (not msg.id or stream.key(msg.id) in fb_seen_comment_ids
+            or fb_last_message_by_user.get(user_key) == msg.text
+            or not fb_seen_comment_ids.add(stream.key(msg.id))):
+        deduped_total.inc("Facebook")
+        return False
+    fb_last_message_by_user[user_key] = msg.text
+    msg.mark("deduped")
+    return True
+
+def deliver_fb_comment(stream, msg: ChatMessage):
+    log("chat", "[{label}] [{created}] {user}: {text}", label=stream.label("Facebook"), stream=stream.name,
+        created=msg.created, user=msg.user, text=msg.text)
+    ingested_total.inc("Facebook")
+    chat_analytics.observe(stream, msg)
+    archive_message(stream, msg)
+    stream.notify(msg)
+
+async def fetch_new_comments(stream, video_id, first_page=None):
+    """New comments since the last call, following paging.next until caught up.
+
+    `first_page` lets a caller pass the first page it already fetched (e.g.
+    inside a Graph batch) instead of requesting it again.
+    """
+    fb_cursor = stream.fb_cursor
     url = f"{GRAPH}/{video_id}/comments"
-    params = {"fields": "id,from{name},message,created_time","order": "reverse_chronological","access_token": FB_PAGE_TOKEN,"limit": 25}
-    res = safe_request(url, params)
-    items = res.get("data", [])
+    params = {**fb_cursor.params(), "access_token": stream.fb_page_token}
     fresh = []
-    for c in reversed(items):
-        cid = c.get("id")
-        if not cid or cid in fb_seen_comment_ids:
-            continue
-        user = c.get("from", {}).get("name", "Unknown")
-        msg = c.get("message", "")
-        if fb_last_message_by_user.get(user) == msg:
-            continue
-        fb_seen_comment_ids.add(cid)
-        fb_last_message_by_user[user] = msg
-        fresh.append({"from": {"name": user}, "message": msg, "created_time": c.get("created_time")})
+    for page_no in range(FB_MAX_PAGES_PER_POLL):
+        if page_no == 0 and first_page is not None:
+            res = first_page
+        else:
+            res = await safe_request(url, params)
+        if not res:
+            if fb_cursor.after and page_no == 0:
+                fb_cursor.after = None  # stale cursor: resume from the timestamp instead
+            break
+        for c in res.get("data", []):
+            created = parse_fb_time(c.get("created_time"))
+            if created is not None and created > (fb_cursor.since or 0):
+                fb_cursor.since = created
+            msg = fb_comment(c)
+            if is_new_fb_comment(stream, msg):
+                fresh.append(msg)
+        paging = res.get("paging", {})
+        fb_cursor.after = paging.get("cursors", {}).get("after") or fb_cursor.after
+        if not paging.get("next"):
+            break
+        # paging.next already carries every query parameter, token included
+        url, params = paging["next"], None
     return fresh
 
-def listen_facebook():
-    print("📡 [Facebook] Connecting via Graph API polling...")
+async def poll_facebook(stream, video_id, check_live: bool):
+    """One poll: new comments, plus (when due) whether the video is still live.
+
+    The live check and the first comments page share one Graph batch call.
+    """
+    if not check_live:
+        return await fetch_new_comments(stream, video_id), True
+    comments_url = f"{video_id}/comments?{urlencode(stream.fb_cursor.params())}"
+    video, first_page = await graph_batch([f"{video_id}?fields=live_status", comments_url], stream.fb_page_token)
+    live = video.get("live_status", "LIVE") == "LIVE"  # an errored check is not proof it ended
+    return await fetch_new_comments(stream, video_id, first_page), live
+
+async def listen_facebook(stream):
+    log("info", f"📡 [{stream.label('Facebook')}] Connecting via Graph API polling...")
     last_token_refresh = time.time()
-    video_id = None
-    while not video_id:
-        video_id = get_live_video()
-        if not video_id:
-            print("🔍 [Facebook] No live video yet, retrying in 5s...")
-            time.sleep(5)
-    print(f"💬 [Facebook] Listening for comments on video: {video_id}")
     while True:
-        if time.time() - last_token_refresh > 3000:
-            refresh_fb_token()
-            last_token_refresh = time.time()
-        comments = fetch_new_comments(video_id)
-        for c in comments:
-            ts = c.get("created_time", "")
-            user = c.get("from", {}).get("name", "Unknown")
-            msg = c.get("message", "")
-            print(f"[Facebook] [{ts}] {user}: {msg}")
-            ntfy_queue.put({"title": "Facebook", "user": user, "msg": msg})
-        time.sleep(1)
+        video_id = None
+        while not video_id:
+            video_id = await get_live_video(stream)
+            if not video_id:
+                log("info", f"🔍 [{stream.label('Facebook')}] No live video yet, retrying in 5s...")
+                await asyncio.sleep(5)
+        if stream.fb_cursor.video_id != video_id:  # keep a cursor restored by a takeover
+            stream.fb_cursor.reset(video_id)
+        last_live_check = time.time()
+        log("info", f"💬 [{stream.label('Facebook')}] Listening for comments on video: {video_id}")
+        while True:
+            if time.time() - last_token_refresh > 3000:
+                await refresh_fb_token(stream)
+                last_token_refresh = time.time()
+            check_live = time.time() - last_live_check >= FB_LIVE_CHECK_INTERVAL
+            poll_started = time.monotonic()
+            comments, live = await poll_facebook(stream, video_id, check_live)
+            poll_seconds.observe(time.monotonic() - poll_started, "Facebook")
+            if check_live:
+                last_live_check = time.time()
+            for msg in comments:
+                deliver_fb_comment(stream, msg)
+            stream.checkpoint("facebook")
+            if not live:
+                log("info", f"🏁 [{stream.label('Facebook')}] Live video {video_id} ended, looking for the next one...")
+                stream.fb_live_posts = frozenset()
+                break
+            # while the webhook is delivering, polling is only a safety net
+            await asyncio.sleep(FB_PUSH_FALLBACK_INTERVAL if stream.fb_push_active() else 1)
 
 # =====================================================
 # --- Kick ---
 # =====================================================
 POLL_INTERVAL = KICK_POLL_INTERVAL  # how often to poll Kick for new messages
 TIME_WINDOW_MINUTES = KICK_TIME_WINDOW_MINUTES
-MESSAGE_DELAY = int(os.getenv("MESSAGE_DELAY", 5))  # delay in seconds between notifications
-
-if not KICK_CHANNEL:
-    raise ValueError("Please set KICK_CHANNEL environment variable")
-
-kick_api = KickAPI()
 
 # --- Emoji Mapping ---
 EMOJI_MAP = {"GiftedYAY": "🎉", "ErectDance": "💃"}
-emoji_pattern = r"\[emote:(\d+):([^\]]+)\]"
+emoji_pattern = re.compile(r"\[emote:(\d+):([^\]]*)\]")
+
+def _emote(match) -> str:
+    emote_name = match.group(2)
+    return EMOJI_MAP.get(emote_name) or f"[{emote_name}]"
 
 def extract_emoji(text: str) -> str:
-    """Extract and replace Kick emote codes with mapped emojis."""
-    matches = re.findall(emoji_pattern, text)
-    for emote_id, emote_name in matches:
-        emoji_char = EMOJI_MAP.get(emote_name, f"[{emote_name}]")
-        text = text.replace(f"[emote:{emote_id}:{emote_name}]", emoji_char)
-    return text
-
-def send_ntfy(user: str, msg: str):
-    """Send chat message notifications to NTFY."""
-    try:
-        formatted_msg = f"{user}: {msg}"
-        if len(formatted_msg) <= MAX_SHORT_MSG_LEN:
-            requests.post(f"https://ntfy.sh/{NTFY_TOPIC}",
-                          data=formatted_msg.encode("utf-8"),
-                          headers={"Title": "Kick"},
-                          timeout=5)
-        else:
-            parts = split_message(formatted_msg, MAX_SHORT_MSG_LEN)
-            for i, part in enumerate(parts, 1):
-                part_title = f"Kick [{i}/{len(parts)}]" if len(parts) > 1 else "Kick"
-                requests.post(f"https://ntfy.sh/{NTFY_TOPIC}",
-                              data=part.encode("utf-8"),
-                              headers={"Title": part_title},
-                              timeout=5)
-                if i < len(parts):
-                    time.sleep(3)
-    except Exception:
-        pass  # suppress errors so they don’t appear in log
+    """Replace every Kick `[emote:ID:NAME]` code with its emoji (or `[NAME]`) in one pass."""
+    if "[emote:" not in text:
+        return text
+    return emoji_pattern.sub(_emote, text)
+
+KICK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
 
-def get_live_chat(channel_id: int):
-    """Fetch live chat messages for a given channel ID."""
+def parse_kick_time(value: str):
     try:
-        past_time = datetime.utcnow() - timedelta(minutes=TIME_WINDOW_MINUTES)
-        formatted_time = past_time.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+class KickChatCursor:
+    """High-water mark over Kick's own message timestamps and IDs.
 
-        chat = kick_api.chat(channel_id, formatted_time)
+    Each poll asks for messages from the newest timestamp already seen
+    (whole seconds, which is what `start_time` accepts), so consecutive
+    windows only overlap inside that one second, and the IDs seen in it
+    filter the overlap out. Until the first message arrives, the window
+    start stays pinned where it began, so it widens by itself after a
+    stall; it never reaches back more than KICK_MAX_BACKFILL_MINUTES.
+    """
+
+    def __init__(self, window_minutes=TIME_WINDOW_MINUTES, max_backfill_minutes=KICK_MAX_BACKFILL_MINUTES):
+        self.window = timedelta(minutes=window_minutes)
+        self.max_backfill = timedelta(minutes=max_backfill_minutes)
+        self.since = None  # start of the next window (UTC, whole seconds)
+        self.ids_at_since = set()  # IDs already seen at or after `since`
+
+    def start_time(self) -> datetime:
+        now = datetime.now(timezone.utc)
+        if self.since is None:
+            self.since = (now - self.window).replace(microsecond=0)
+        return max(self.since, (now - self.max_backfill).replace(microsecond=0))
+
+    def to_state(self) -> dict:
+        return {"since": self.since.isoformat() if self.since else None, "ids": sorted(map(str, self.ids_at_since))}
+
+    def load_state(self, state: dict):
+        self.since = datetime.fromisoformat(state["since"]) if state.get("since") else None
+        self.ids_at_since = set(state.get("ids", []))
+
+    def advance(self, raw_messages: list) -> list:
+        """Drop already-processed messages and move the mark past the rest."""
+        since = self.start_time()
+        fresh, newest = [], None
+        for m in raw_messages:
+            created = parse_kick_time(m.get("created_at"))
+            if created is not None and created < since:
+                continue
+            mid = m.get("id")
+            if mid in self.ids_at_since:
+                continue
+            fresh.append((created or since, m))
+            if created is not None and (newest is None or created > newest):
+                newest = created
+        fresh.sort(key=lambda pair: pair[0])
+
+        if newest is not None:
+            mark = newest.replace(microsecond=0)
+            if mark > since:
+                self.ids_at_since = set()
+            self.since = mark
+            for created, m in fresh:
+                if created >= mark:
+                    self.ids_at_since.add(m.get("id"))
+        return [m for _, m in fresh]
+
+def fetch_kick_messages(channel_id: int, start_time: datetime) -> list:
+    """Raw chat page from Kick (kickapi's ChatData drops the message IDs)."""
+    url = f"https://{KICK_HOST}/api/v2/channels/{channel_id}/messages"
+    res = kick_api.session.get(url, params={"start_time": start_time.strftime(KICK_TIME_FORMAT)},
+                               headers=kick_api.headers, timeout=10)
+    return res.json().get("data", {}).get("messages", []) or []
+
+async def get_live_chat(channel_id: int, kick_cursor: KickChatCursor):
+    """Fetch chat messages posted since the cursor's mark for a given channel ID."""
+    started = time.monotonic()
+    try:
+        raw = await http_pool.call(KICK_HOST, fetch_kick_messages, channel_id, kick_cursor.start_time())
         messages = []
 
-        if chat and hasattr(chat, "messages") and chat.messages:
-            for msg in chat.messages:
-                message_text = getattr(msg, "text", "No text")
-                message_text = extract_emoji(message_text)
-                messages.append({
-                    "id": getattr(msg, "id", f"{msg.sender.username}:{message_text}"),
-                    "username": getattr(msg.sender, "username", "Unknown"),
-                    "text": message_text,
-                    "timestamp": datetime.now().strftime("%H:%M:%S"),
-                })
+        for msg in kick_cursor.advance(raw):
+            messages.append(kick_message(msg))
 
         return messages
-    except Exception:
+    except Exception as e:
+        api_error("Kick", type(e).__name__)
         return []
+    finally:
+        poll_seconds.observe(time.monotonic() - started, "Kick")
 
-def listen_kick():
-    """Listen to live chat, log instantly, send to NTFY with delay."""
-    channel = kick_api.channel(KICK_CHANNEL)
-    if not channel:
-        raise ValueError(f"Channel '{KICK_CHANNEL}' not found")
+def kick_message(raw: dict) -> ChatMessage:
+    """Parse a raw Kick message (REST page or WebSocket event)."""
+    username = (raw.get("sender") or {}).get("username", "Unknown")
+    message_text = extract_emoji(raw.get("content", "No text"))
+    msg = ChatMessage("Kick", raw.get("id") or f"{username}:{message_text}", username, message_text,
+                      datetime.now().strftime("%H:%M:%S"))
+    created = parse_kick_time(raw.get("created_at")) if msg.trace is not None else None
+    if created:
+        msg.mark("created", created.timestamp())
+    return msg
 
-    seen_ids = set()
-    queue = []
-    last_sent_time = 0
+def handle_kick_message(stream, msg: ChatMessage):
+    if kick_seen_ids.add(stream.key(msg.id)):
+        msg.mark("deduped")
+        # log instantly
+        log("chat", "[{label}] [{created}] {user}: {text}", label=stream.label("Kick"), stream=stream.name,
+            created=msg.created, user=msg.user, text=msg.text)
+        ingested_total.inc("Kick")
+        chat_analytics.observe(stream, msg)
+        archive_message(stream, msg)
+        # Sending is paced by the NTFY worker, never by the fetch loop
+        stream.notify(msg)
+    else:
+        deduped_total.inc("Kick")
 
-    print(f"📡 [Kick] Connected to chat: {channel.username}")
+def fetch_kick_channel(slug: str):
+    """kickapi's KickAPI.channel, with a timeout (the library sends none)."""
+    res = kick_api.session.get(f"https://{KICK_HOST}/api/v1/channels/{slug}", headers=kick_api.headers,
+                               timeout=HTTP_TIMEOUT)
+    try:
+        return ChannelData(res.json(), api=kick_api)
+    except ValueError:
+        return None
 
-    while True:
-        # 1. Fetch new messages
-        messages = get_live_chat(channel.id)
-        for msg in messages:
-            if msg["id"] not in seen_ids:
-                seen_ids.add(msg["id"])
-                queue.append(msg)
-                # log instantly
-                print(f"[Kick] [{msg['timestamp']}] {msg['username']}: {msg['text']}")
+def fetch_kick_chatroom_id(slug: str):
+    res = kick_api.session.get(f"https://{KICK_HOST}/api/v2/channels/{slug}", headers=kick_api.headers, timeout=10)
+    return (res.json().get("chatroom") or {}).get("id")
 
-        # 2. If delay passed and queue has messages, send the next one
-        if queue and (time.time() - last_sent_time >= MESSAGE_DELAY):
-            msg = queue.pop(0)  # FIFO
-            send_ntfy(msg["username"], msg["text"])
-            last_sent_time = time.time()
+async def listen_kick_ws(stream, channel, chatroom_id: int):
+    """Push ingestion over Kick's Pusher chatroom stream.
 
-        time.sleep(1)
+    Every (re)connect subscribes first and then backfills over REST from the
+    cursor's high-water mark, so the gap while disconnected is resumed
+    rather than lost; the overlap is removed by the cursor and kick_seen_ids.
+    A socket quiet for KICK_WS_ACTIVITY_TIMEOUT gets a pusher:ping, and if
+    nothing comes back within KICK_WS_PONG_TIMEOUT it is treated as dead,
+    so a half-open connection is replaced well inside the backfill window.
+    Returns after KICK_WS_MAX_FAILURES consecutive failures.
+    """
+    subscribe = json.dumps({"event": "pusher:subscribe",
+                            "data": {"auth": "", "channel": f"chatrooms.{chatroom_id}.v2"}})
+    failures = 0
+    while failures < KICK_WS_MAX_FAILURES:
+        try:
+            async with ws_connect(KICK_PUSHER_URL, open_timeout=10, ping_interval=None) as ws:
+                await ws.send(subscribe)
+                for msg in await get_live_chat(channel.id, stream.kick_cursor):
+                    handle_kick_message(stream, msg)
+                log("info", f"⚡ [{stream.label('Kick')}] Subscribed to chatroom {chatroom_id}")
+                failures = 0
+                pinged = False
+                while True:
+                    try:
+                        frame = await asyncio.wait_for(ws.recv(), KICK_WS_PONG_TIMEOUT if pinged else KICK_WS_ACTIVITY_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        if pinged:
+                            raise ConnectionError(f"no pong within {KICK_WS_PONG_TIMEOUT:g}s") from None
+                        await ws.send(json.dumps({"event": "pusher:ping", "data": {}}))
+                        pinged = True
+                        continue
+                    pinged = False  # any frame shows the connection is alive
+                    event = json.loads(frame)
+                    name = event.get("event")
+                    if name == "pusher:ping":
+                        await ws.send(json.dumps({"event": "pusher:pong", "data": {}}))
+                    elif name == "pusher:error":
+                        raise ConnectionError(event.get("data"))
+                    elif name == "App\\Events\\ChatMessageEvent":
+                        data = event.get("data")
+                        raw = json.loads(data) if isinstance(data, str) else data
+                        for fresh in stream.kick_cursor.advance([raw]):
+                            handle_kick_message(stream, kick_message(fresh))
+                        stream.checkpoint("kick")
+        except Exception as e:
+            failures += 1
+            api_error("Kick", f"ws_{type(e).__name__}")
+            log("warn", f"⚠️ [{stream.label('Kick')}] WebSocket dropped ({e}), reconnect {failures}/{KICK_WS_MAX_FAILURES}...")
+            await asyncio.sleep(min(30, 2 ** failures))
+
+async def listen_kick(stream):
+    """Listen to live chat, log instantly, hand new messages to the NTFY worker."""
+    channel = await http_pool.call(KICK_HOST, fetch_kick_channel, stream.kick_channel)
+    if not channel:
+        raise ValueError(f"Channel '{stream.kick_channel}' not found")
+
+    log("info", f"📡 [{stream.label('Kick')}] Connected to chat: {channel.username}")
+
+    if KICK_WEBSOCKET and ws_connect is not None:
+        try:
+            chatroom_id = await http_pool.call(KICK_HOST, fetch_kick_chatroom_id, channel.username)
+        except Exception as e:
+            chatroom_id = None
+            log("warn", f"⚠️ [{stream.label('Kick')}] Could not look up chatroom: {e}")
+        if chatroom_id:
+            await listen_kick_ws(stream, channel, chatroom_id)
+        log("info", f"🔁 [{stream.label('Kick')}] Falling back to polling")
+
+    while True:
+        for msg in await get_live_chat(channel.id, stream.kick_cursor):
+            handle_kick_message(stream, msg)
+        stream.checkpoint("kick")
+        await asyncio.sleep(1)
 
 
 # =====================================================
-# --- YouTube with 2 API Keys ---
+# --- YouTube with API Key Pool ---
 # =====================================================
-def listen_youtube():
-    print("📡 [YouTube] Connecting...")
-    if not YOUTUBE_API_KEY:
-        print("⚠️ [YouTube] API not set, skipping.")
-        return
+YOUTUBE_API = "https://www.googleapis.com/youtube/v3"
+YOUTUBE_QUOTA_COSTS = {"playlistItems.list": 1, "videos.list": 1, "liveChatMessages.list": 5}
+YOUTUBE_RECONNECT_WINDOW = 300  # seconds after a chat ends in which lookups may spend the reserve
 
-    global yt_sent_messages, yt_last_message_by_user
+try:
+    YOUTUBE_QUOTA_TZ = ZoneInfo("America/Los_Angeles")  # quotas reset at midnight Pacific
+except ZoneInfoNotFoundError:
+    YOUTUBE_QUOTA_TZ = timezone(timedelta(hours=-8))
 
-    api_keys = [YOUTUBE_API_KEY]
-    if os.getenv("YOUTUBE_API_KEY_2"):
-        api_keys.append(os.getenv("YOUTUBE_API_KEY_2"))
+def youtube_api_keys() -> list:
+    """YOUTUBE_API_KEY, YOUTUBE_API_KEY_2..N and comma-separated YOUTUBE_API_KEYS."""
+    keys = [YOUTUBE_API_KEY] if YOUTUBE_API_KEY else []
+    n = 2
+    while os.getenv(f"YOUTUBE_API_KEY_{n}"):
+        keys.append(os.getenv(f"YOUTUBE_API_KEY_{n}"))
+        n += 1
+    keys += [k.strip() for k in os.getenv("YOUTUBE_API_KEYS", "").split(",") if k.strip()]
+    return list(dict.fromkeys(keys))
 
-    current_key_index = 0
+def seconds_until_quota_reset() -> float:
+    now = datetime.now(YOUTUBE_QUOTA_TZ)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
 
-    def get_current_key():
-        return api_keys[current_key_index]
+class YouTubeKeyPool:
+    """Spread Data API calls over N keys by tracking each key's units used today.
 
-    def rotate_key():
-        nonlocal current_key_index
-        current_key_index = (current_key_index + 1) % len(api_keys)
-        print(f"🔑 Rotated to YouTube API key {current_key_index+1}/{len(api_keys)}")
+    Every call is charged its endpoint's unit cost up front and goes to the
+    key with the most quota left, so keys drain evenly instead of one by
+    one. Usage is persisted (by key fingerprint, never the key itself) so
+    a restart does not forget what was spent. `min_interval` tells each chat
+    poller how slowly it must go for the remaining budget, shared by all
+    `pollers` currently attached to a live chat, to last for the rest of an
+    expected YOUTUBE_STREAM_HOURS stream (or until the reset, if sooner).
+    `check_interval` paces the `watchers` waiting for a channel to go live
+    so they never spend more than YOUTUBE_OFFLINE_SHARE of what is left.
+    YOUTUBE_QUOTA_RESERVE is only handed out to reconnect lookups.
+    """
 
-    while True:
+    def __init__(self, keys, daily_quota=YOUTUBE_DAILY_QUOTA, state_file=YOUTUBE_QUOTA_FILE):
+        self.keys = list(keys)
+        self.daily_quota = daily_quota
+        self.state_file = state_file
+        self.day = self._today()
+        self.used = {key: 0 for key in self.keys}
+        self.pollers = 0
+        self.watchers = 0  # streams checking whether their channel is live
+        self.live_since = None  # when the first of the current pollers attached
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        self._load()
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(YOUTUBE_QUOTA_TZ).strftime("%Y-%m-%d")
+
+    @staticmethod
+    def _fingerprint(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+    def _load(self):
+        if not self.state_file:
+            return
         try:
-            key = get_current_key()
-            search_url = f"https://www.googleapis.com/youtube/v3/search?part=snippet&channelId={YOUTUBE_CHANNEL_ID}&eventType=live&type=video&maxResults=1&key={key}"
-            resp = requests.get(search_url).json()
-
-            if "error" in resp:
-                err = resp["error"]
-                reason = err.get("errors", [{}])[0].get("reason", "")
-                if err.get("code") == 403 and "quotaExceeded" in reason:
-                    print("⚠️ [YouTube] Quota exceeded for current key, rotating...")
-                    rotate_key()
-                    time.sleep(5)
-                    continue
-                else:
-                    print("⚠️ [YouTube] API error:", err)
-                    time.sleep(30)
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("day") == self.day:
+            by_fp = state.get("used", {})
+            for key in self.keys:
+                self.used[key] = int(by_fp.get(self._fingerprint(key), 0))
+
+    def save_due(self) -> bool:
+        return self.dirty and time.monotonic() - self.saved_at >= YOUTUBE_QUOTA_SAVE_INTERVAL
+
+    def save(self):
+        """Write usage to the state file; blocking, so the engine runs it on the I/O pool."""
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        if not self.state_file:
+            return
+        state = {"day": self.day, "used": {self._fingerprint(k): v for k, v in self.used.items()}}
+        try:
+            with open(self.state_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(self.state_file + ".tmp", self.state_file)
+        except OSError as e:
+            log("warn", f"⚠️ [YouTube] Could not save quota usage: {e}")
+
+    def _roll_day(self):
+        today = self._today()
+        if today != self.day:
+            self.day = today
+            self.used = {key: 0 for key in self.keys}
+
+    def remaining(self, key: str) -> int:
+        self._roll_day()
+        return max(0, self.daily_quota - self.used.get(key, 0))
+
+    def total(self) -> int:
+        return sum(self.remaining(key) for key in self.keys)
+
+    def acquire(self, endpoint: str, reserve: int = YOUTUBE_QUOTA_RESERVE):
+        """Charge one call to the key with the most quota left; None if all are spent.
+
+        The call is refused when it would leave the pool under `reserve`;
+        only reconnect lookups pass 0.
+        """
+        cost = YOUTUBE_QUOTA_COSTS[endpoint]
+        self._roll_day()
+        key = max(self.keys, key=self.remaining, default=None)
+        if key is None or self.remaining(key) < cost or self.total() - cost < reserve:
+            return None
+        self.used[key] += cost
+        self.dirty = True
+        return key
+
+    def exhausted(self, key: str):
+        """Google says this key is out of quota: stop picking it until the reset."""
+        self.used[key] = self.daily_quota
+        self.dirty = True
+        self.saved_at = 0.0  # worth saving straight away
+
+    def attach(self):
+        if not self.pollers:
+            self.live_since = time.monotonic()
+        self.pollers += 1
+
+    def detach(self):
+        self.pollers -= 1
+        if not self.pollers:
+            self.live_since = None
+
+    def watch(self):
+        self.watchers += 1
+
+    def unwatch(self):
+        self.watchers -= 1
+
+    def check_interval(self) -> float:
+        """Seconds between offline live checks (see find_live_chat), at least 30."""
+        cost = YOUTUBE_QUOTA_COSTS["playlistItems.list"] + YOUTUBE_QUOTA_COSTS["videos.list"]
+        spare = (self.total() - YOUTUBE_QUOTA_RESERVE) * YOUTUBE_OFFLINE_SHARE
+        checks_left = max(spare // cost, 1)
+        return max(30.0, seconds_until_quota_reset() / checks_left * max(self.watchers, 1))
+
+    def min_interval(self, endpoint: str) -> float:
+        cost = YOUTUBE_QUOTA_COSTS[endpoint]
+        budget = self.total() - YOUTUBE_QUOTA_RESERVE
+        calls_left = max(budget // cost, 1)
+        live_for = time.monotonic() - self.live_since if self.live_since is not None else 0.0
+        # budget for the rest of the expected stream, but at least the next 15 minutes
+        horizon = min(seconds_until_quota_reset(), max(YOUTUBE_STREAM_HOURS * 3600 - live_for, 900))
+        return horizon / calls_left * max(self.pollers, 1)
+
+    def summary(self) -> str:
+        return ", ".join(f"key {i + 1}: {self.remaining(k)}/{self.daily_quota}" for i, k in enumerate(self.keys))
+
+youtube_keys = YouTubeKeyPool(youtube_api_keys())
+atexit.register(lambda: youtube_keys.dirty and youtube_keys.save())
+
+# Fetch and delivery are separate stages: the poller follows
+# pollingIntervalMillis, and deliver_youtube() paces the hand-off to ntfy.
+# Each stream keeps its own delivery queue and stage metrics.
+def youtube_stage_lag(stream) -> dict:
+    """How far behind each YouTube stage of a stream is right now."""
+    queue = stream.yt_delivery_queue
+    oldest = queue[0][0] if queue else None
+    return {
+        **stream.yt_stage_metrics,
+        "delivery_backlog": len(queue),
+        "delivery_oldest_age": time.monotonic() - oldest if oldest is not None else 0.0,
+    }
+
+async def deliver_youtube(stream):
+    """Hand fetched YouTube messages to the NTFY queue, YOUTUBE_NTFY_DELAY apart."""
+    queue = stream.yt_delivery_queue
+    while True:
+        while not queue:
+            stream.yt_delivery_ready.clear()
+            await stream.yt_delivery_ready.wait()
+        fetched_at, msg_obj = queue.popleft()
+        ntfy_queue.put_nowait(msg_obj)
+        stream.yt_stage_metrics["delivered"] += 1
+        stream.yt_stage_metrics["delivery_lag"] = time.monotonic() - fetched_at
+        await asyncio.sleep(YOUTUBE_NTFY_DELAY)
+
+def youtube_message(item: dict) -> ChatMessage:
+    """Parse a liveChatMessages item (`part=snippet,authorDetails`)."""
+    snippet = item.get("snippet") or {}
+    msg = ChatMessage("YouTube", item.get("id"), (item.get("authorDetails") or {}).get("displayName", "Unknown"),
+                      snippet.get("displayMessage", ""), snippet.get("publishedAt", ""))
+    created = parse_kick_time(msg.created) if msg.trace is not None else None  # ISO 8601, like Kick's
+    if created:
+        msg.mark("created", created.timestamp())
+    return msg
+
+def youtube_error_reason(err: dict) -> str:
+    return (err.get("errors") or [{}])[0].get("reason", "")
+
+async def youtube_call(endpoint: str, path: str, params: dict, reserve: int = YOUTUBE_QUOTA_RESERVE) -> dict:
+    """GET a YouTube Data API resource on the best key, moving past exhausted ones."""
+    while True:
+        key = youtube_keys.acquire(endpoint, reserve)
+        if key is None:
+            wait = seconds_until_quota_reset()
+            left = f"only the {reserve}-unit reserve is left" if youtube_keys.total() >= YOUTUBE_QUOTA_COSTS[endpoint] \
+                else f"all {len(youtube_keys.keys)} keys are out of quota"
+            log("warn", f"⚠️ [YouTube] {endpoint}: {left}, waiting {wait / 60:.0f} min for the reset...")
+            await asyncio.sleep(min(wait + 5, 3600))
+            continue
+        if youtube_keys.save_due():
+            await run_blocking(youtube_keys.save)
+        data = await get_json(f"{YOUTUBE_API}/{path}", params={**params, "key": key})
+        err = data.get("error")
+        if err:
+            api_error("YouTube", youtube_error_reason(err) or f"code_{err.get('code')}")
+        if err and err.get("code") == 403 and "quotaExceeded" in youtube_error_reason(err):
+            youtube_keys.exhausted(key)
+            log("warn", f"⚠️ [YouTube] Quota exceeded for a key, switching ({youtube_keys.summary()})")
+            continue
+        return data
+
+async def find_live_chat(stream, reserve: int = YOUTUBE_QUOTA_RESERVE):
+    """The live chat ID of the channel's running broadcast, or None.
+
+    A broadcast is listed in the channel's uploads while it is live, so two
+    1-unit calls (newest uploads, then their live details) do what
+    search.list?eventType=live did for 100 units.
+    """
+    tag = stream.label("YouTube")
+    uploads = await youtube_call("playlistItems.list", "playlistItems", {
+        "part": "contentDetails", "playlistId": "UU" + stream.youtube_channel_id[2:], "maxResults": 5,
+    }, reserve)
+    if "error" in uploads:
+        log("warn", "⚠️ [{label}] API error: {error}", label=tag, error=uploads["error"])
+        return None
+    video_ids = [item["contentDetails"]["videoId"] for item in uploads.get("items", [])]
+    if not video_ids:
+        return None
+
+    details = await youtube_call("videos.list", "videos", {
+        "part": "snippet,liveStreamingDetails", "id": ",".join(video_ids),
+    }, reserve)
+    for video in details.get("items", []):
+        if (video.get("snippet") or {}).get("liveBroadcastContent") == "live":
+            live_chat_id = (video.get("liveStreamingDetails") or {}).get("activeLiveChatId")
+            if live_chat_id:
+                return live_chat_id
+    return None
+
+async def listen_youtube(stream):
+    tag = stream.label("YouTube")
+    log("info", f"📡 [{tag}] Connecting...")
+    if not youtube_keys.keys:
+        log("warn", f"⚠️ [{tag}] API not set, skipping.")
+        return
+
+    log("info", f"🔑 [{tag}] {len(youtube_keys.keys)} API key(s): {youtube_keys.summary()}")
+
+    reconnect_until = 0.0  # right after a chat ends, lookups may spend the quota reserve
+    youtube_keys.watch()
+    try:
+        while True:
+            try:
+                reconnecting = time.monotonic() < reconnect_until
+                live_chat_id = await find_live_chat(stream, 0 if reconnecting else YOUTUBE_QUOTA_RESERVE)
+                if not live_chat_id:
+                    wait = 30 if reconnecting else youtube_keys.check_interval()
+                    log("error", f"❌ [{tag}] No live stream found, retrying in {wait:.0f}s...")
+                    await asyncio.sleep(wait)
                     continue
 
-            if not resp.get("items"):
-                print("❌ [YouTube] No live stream found, retrying in 30s...")
-                time.sleep(30)
-                continue
+                log("info", f"✅ [{tag}] Connected to live chat!")
+                # every attached chat shares the keys' daily budget
+                youtube_keys.unwatch()
+                youtube_keys.attach()
+                try:
+                    await poll_youtube_chat(stream, live_chat_id)
+                finally:
+                    youtube_keys.detach()
+                    youtube_keys.watch()
+                    reconnect_until = time.monotonic() + YOUTUBE_RECONNECT_WINDOW
 
-            video_id = resp["items"][0]["id"]["videoId"]
+            except Exception as e:
+                log("warn", f"⚠️ [{tag}] Error, retrying in 30s... {e}")
+                await asyncio.sleep(30)
+    finally:
+        youtube_keys.unwatch()
+
+async def poll_youtube_chat(stream, live_chat_id: str):
+    """Fetch stage: follow pollingIntervalMillis and queue new messages for delivery."""
+    tag = stream.label("YouTube")
+    metrics = stream.yt_stage_metrics
+    page_token = None
+    next_poll = time.monotonic()
+
+    while True:
+        poll_started = time.monotonic()
+        metrics["fetch_lag"] = max(0.0, poll_started - next_poll)
+        params = {"liveChatId": live_chat_id, "part": "snippet,authorDetails"}
+        if page_token:
+            params["pageToken"] = page_token
+
+        data = await youtube_call("liveChatMessages.list", "liveChat/messages", params)
+        fetched_at = time.monotonic()
+        metrics["polls"] += 1
+        metrics["fetch_duration"] = fetched_at - poll_started
+        poll_seconds.observe(metrics["fetch_duration"], "YouTube")
+
+        if "error" in data:
+            log("warn", "⚠️ [{label}] API error: {error}", label=tag, error=data["error"])
+            await asyncio.sleep(30)
+            continue
 
-            # Get live chat ID
-            details_url = f"https://www.googleapis.com/youtube/v3/videos?part=liveStreamingDetails&id={video_id}&key={get_current_key()}"
-            details = requests.get(details_url).json()
-            live_chat_id = details["items"][0]["liveStreamingDetails"].get("activeLiveChatId")
-            if not live_chat_id:
-                print("❌ [YouTube] No active chat found, retrying in 30s...")
-                time.sleep(30)
+        for item in data.get("items", []):
+            msg = youtube_message(item)
+            msg_id = stream.key(msg.id)
+            user_key = stream.key(msg.user)
+            if (msg_id in yt_sent_messages or yt_last_message_by_user.get(user_key) == msg.text
+                    or not yt_sent_messages.add(msg_id)):
+                deduped_total.inc("YouTube")
                 continue
+            yt_last_message_by_user[user_key] = msg.text
+            msg.mark("deduped")
+            ingested_total.inc("YouTube")
+            chat_analytics.observe(stream, msg)
+            archive_message(stream, msg)
+            log("chat", "[{label}] {user}: {text}", label=tag, stream=stream.name, user=msg.user, text=msg.text)
+            if route_message(stream, msg):
+                shared_claims.submit(stream, msg, functools.partial(stream.deliver_later, fetched_at))
 
-            print("✅ [YouTube] Connected to live chat!")
-            page_token = None
+        page_token = data.get("nextPageToken")
+        interval = data.get("pollingIntervalMillis", 5000) / 1000
+        # never poll faster than the remaining quota can sustain until the reset
+        interval = max(interval, youtube_keys.min_interval("liveChatMessages.list"))
+        next_poll = poll_started + interval
+        if len(stream.yt_delivery_queue) > 50 and metrics["polls"] % 20 == 0:
+            lag = youtube_stage_lag(stream)
+            log("info", f"⏳ [{tag}] Delivery {lag['delivery_backlog']} behind, oldest waiting {lag['delivery_oldest_age']:.0f}s")
+        await asyncio.sleep(max(0.0, next_poll - time.monotonic()))
 
-            while True:
-                key = get_current_key()
-                chat_url = f"https://www.googleapis.com/youtube/v3/liveChat/messages?liveChatId={live_chat_id}&part=snippet,authorDetails&key={key}"
-                if page_token:
-                    chat_url += f"&pageToken={page_token}"
-
-                data = requests.get(chat_url).json()
-
-                if "error" in data:
-                    err = data["error"]
-                    reason = err.get("errors", [{}])[0].get("reason", "")
-                    if err.get("code") == 403 and "quotaExceeded" in reason:
-                        print("⚠️ [YouTube] Quota exceeded for current key, rotating...")
-                        rotate_key()
-                        time.sleep(5)
-                        continue
-                    else:
-                        print("⚠️ [YouTube] API error:", err)
-                        time.sleep(30)
-                        continue
 
-                for item in data.get("items", []):
-                    msg_id = item["id"]
-                    user = item["authorDetails"]["displayName"]
-                    msg = item["snippet"]["displayMessage"]
-                    if msg_id in yt_sent_messages or yt_last_message_by_user.get(user) == msg:
-                        continue
-                    yt_sent_messages.add(msg_id)
-                    yt_last_message_by_user[user] = msg
-                    print(f"[YouTube] {user}: {msg}")
-                    ntfy_queue.put({"title": "YouTube", "user": user, "msg": msg})
-                    time.sleep(YOUTUBE_NTFY_DELAY)
+# =====================================================
+# --- Streams ---
+# =====================================================
+class Stream:
+    """One streamer: the channels to watch, the ntfy topic, and per-channel state.
 
-                page_token = data.get("nextPageToken")
-                interval = data.get("pollingIntervalMillis", 5000) / 1000
-                time.sleep(interval)
+    Connection pools, dedup caches, YouTube quota and the ntfy send budget
+    are shared by every stream; cursors and delivery queues are not.
+    """
 
-        except Exception as e:
-            print("⚠️ [YouTube] Error, retrying in 30s...", e)
-            yt_sent_messages = set()
-            yt_last_message_by_user = {}
-            time.sleep(30)
+    def __init__(self, name: str, ntfy_topic: str = NTFY_TOPIC, kick_channel: str = "",
+                 youtube_channel_id: str = "", fb_page_id: str = None, fb_page_token: str = None):
+        self.name = name
+        self.ntfy_topic = ntfy_topic or NTFY_TOPIC
+        self.kick_channel = kick_channel or ""
+        self.youtube_channel_id = youtube_channel_id or ""
+        self.fb_page_id = str(fb_page_id) if fb_page_id else None
+        self.fb_page_token = fb_page_token
+        self.labelled = False  # set when several streams share the log
+        self.rules = None  # RuleSet, when RULES_FILE has rules for this stream
+
+        self.kick_cursor = KickChatCursor()
+        self.fb_cursor = FacebookCommentCursor()
+        self.checkpointed = {}  # platform -> monotonic time of the last cursor save
+        self.fb_last_push = 0.0  # when the webhook last brought a comment on the live video
+        self.fb_live_posts = frozenset()  # post IDs of the current live video, for webhook comments
+        self.yt_delivery_queue = deque()  # (fetched_at, ChatMessage)
+        self.yt_delivery_ready = asyncio.Event()
+        self.yt_stage_metrics = {
+            "polls": 0,
+            "fetch_lag": 0.0,  # how late the last poll started vs. the server's interval
+            "fetch_duration": 0.0,
+            "delivered": 0,
+            "delivery_lag": 0.0,  # time the last delivered message waited after being fetched
+        }
+
+    def key(self, item_id) -> str:
+        """Key into the shared dedup caches."""
+        return f"{self.name}:{item_id}"
+
+    def label(self, platform: str) -> str:
+        return f"{platform}/{self.name}" if self.labelled else platform
+
+    def notify(self, msg: ChatMessage):
+        if route_message(self, msg):
+            shared_claims.submit(self, msg, ntfy_queue.put_nowait)
+
+    def deliver_later(self, fetched_at: float, msg: ChatMessage):
+        """Queue a YouTube message for deliver_youtube's paced hand-off.
+
+        It goes into the WAL here, not when it reaches the ntfy queue, so a
+        restart with a delivery backlog still sends what was already claimed.
+        """
+        if ntfy_log is not None and msg.offset is None:
+            msg.offset = ntfy_log.append(msg.to_dict())
+        self.yt_delivery_queue.append((fetched_at, msg))
+        self.yt_delivery_ready.set()
+
+    def fb_push_active(self) -> bool:
+        return time.time() - self.fb_last_push < FB_PUSH_GRACE
+
+    def cursor(self, platform: str):
+        return {"kick": self.kick_cursor, "facebook": self.fb_cursor}[platform]
+
+    def checkpoint(self, platform: str, force: bool = False):
+        """Persist a cursor to the shared store (at most every CURSOR_CHECKPOINT_INTERVAL)."""
+        if state_store is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.checkpointed.get(platform, 0.0) < CURSOR_CHECKPOINT_INTERVAL:
+            return
+        self.checkpointed[platform] = now
+        shared_claims.save_cursor(self.name, platform, self.cursor(platform).to_state())
+
+    def restore(self):
+        """Pick up where the previous owner of this stream left off."""
+        if state_store is None:
+            return
+        for platform in ("kick", "facebook"):
+            state = state_store.load_cursor(self.name, platform)
+            if state:
+                self.cursor(platform).load_state(state)
+
+def load_streams(path: str = STREAMS_CONFIG) -> list:
+    """Streams from the JSON config file, or a single one from the env vars.
+
+    Facebook tokens can be given inline ("page_token") or, better, by the
+    name of an env var holding them ("page_token_env").
+    """
+    if not path or not os.path.exists(path):
+        return [Stream("default", NTFY_TOPIC, KICK_CHANNEL, YOUTUBE_CHANNEL_ID, FB_PAGE_ID, FB_PAGE_TOKEN)]
+
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    entries = config.get("streams", []) if isinstance(config, dict) else config
+    streams, names = [], set()
+    for i, entry in enumerate(entries, 1):
+        name = entry.get("name") or f"stream{i}"
+        if name in names:
+            raise ValueError(f"Duplicate stream name '{name}' in {path}")
+        names.add(name)
+        fb = entry.get("facebook") or {}
+        token = fb.get("page_token") or (os.getenv(fb["page_token_env"]) if fb.get("page_token_env") else None)
+        stream = Stream(name, entry.get("ntfy_topic"), entry.get("kick"), entry.get("youtube"), fb.get("page_id"), token)
+        stream.labelled = True
+        streams.append(stream)
+    log("info", f"🗂️ Loaded {len(streams)} stream(s) from {path}")
+    return streams
+
+STREAMS = load_streams()
+attach_rules(STREAMS, load_rules())
+
+# youtube_stage_lag() field -> (metric name, help), one gauge per YouTube stream each
+YOUTUBE_STAGE_GAUGES = {
+    "polls": ("livechat_youtube_polls", "liveChatMessages polls made since start."),
+    "fetch_lag": ("livechat_youtube_fetch_lag_seconds", "How late the last poll started against pollingIntervalMillis."),
+    "fetch_duration": ("livechat_youtube_fetch_duration_seconds", "How long the last poll took."),
+    "delivered": ("livechat_youtube_delivered", "Messages handed to ntfy since start."),
+    "delivery_lag": ("livechat_youtube_delivery_lag_seconds",
+                     "How long the last delivered message waited after being fetched."),
+    "delivery_backlog": ("livechat_youtube_delivery_backlog", "Fetched YouTube messages not yet handed to ntfy."),
+    "delivery_oldest_age": ("livechat_youtube_delivery_oldest_age_seconds",
+                            "Age of the oldest fetched message not yet handed to ntfy."),
+}
+
+def youtube_stage_gauge(field: str):
+    return lambda: {(stream.name,): youtube_stage_lag(stream)[field] for stream in STREAMS if stream.youtube_channel_id}
+
+for field, (name, description) in YOUTUBE_STAGE_GAUGES.items():
+    Gauge(name, description, youtube_stage_gauge(field), labels=["stream"])
 
 
 # =====================================================
 # --- Start All Listeners ---
 # =====================================================
+def stream_listeners(stream) -> list:
+    """One coroutine per platform configured on a stream."""
+    listeners = []
+    if stream.fb_page_id:
+        listeners.append(functools.partial(listen_facebook, stream))
+    if stream.kick_channel:
+        listeners.append(functools.partial(listen_kick, stream))
+    if stream.youtube_channel_id:
+        listeners.append(functools.partial(listen_youtube, stream))
+        listeners.append(functools.partial(deliver_youtube, stream))
+    return listeners
+
+def shared_listeners() -> list:
+    listeners = [ntfy_batch_worker if NTFY_BATCH else ntfy_worker, report_http_stats]
+    if ntfy_log is not None:
+        listeners.append(run_ntfy_log)
+    if state_store is not None:
+        listeners.append(run_shared_claims)
+    if TRACE_FILE:
+        listeners.append(run_trace_writer)
+    if chat_archive is not None:
+        listeners.append(run_chat_archive)
+    if ANALYTICS_SUMMARY_INTERVAL > 0:
+        listeners.append(run_chat_summary)
+    return listeners
+
+def build_listeners(streams) -> list:
+    """The shared workers plus one coroutine per platform of every stream."""
+    shared = shared_listeners()
+    listeners = list(shared)
+    for stream in streams:
+        listeners += stream_listeners(stream)
+    if len(listeners) == len(shared):
+        log("warn", "⚠️ No channels configured: set KICK_CHANNEL / YOUTUBE_CHANNEL_ID / FB_PAGE_ID or STREAMS_CONFIG")
+    return listeners
+
+def listener_name(listener) -> str:
+    if isinstance(listener, functools.partial):
+        return f"{listener.func.__name__}[{listener.args[0].name}]"
+    return listener.__name__
+
+async def run_listener(listener):
+    """Run one listener; a crash stops only that source, like a dead thread did."""
+    try:
+        await listener()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log("error", f"❌ [Engine] {listener_name(listener)} stopped: {e}")
+
+engine_loop = None
+engine_ready = threading.Event()
+engine_start_lock = threading.Lock()
+engine_started = False
+
+def submit_to_engine(func, *args) -> bool:
+    """Run a plain callback on the engine loop from another thread (e.g. a web worker)."""
+    if not engine_ready.wait(5):
+        return False
+    engine_loop.call_soon_threadsafe(func, *args)
+    return True
+
+async def run_engine(listeners=None):
+    """Run every listener as a task on the current event loop."""
+    tasks = await run_engine_tasks(listeners or build_listeners(STREAMS))
+    log("info", "✅ All listeners started.")
+    await asyncio.gather(*tasks)
+
 def start_all_listeners():
-    threading.Thread(target=ntfy_worker, daemon=True).start()
-    threading.Thread(target=listen_facebook, daemon=True).start()
-    threading.Thread(target=listen_kick, daemon=True).start()
-    threading.Thread(target=listen_youtube, daemon=True).start()
-    print("✅ All listeners started.")
+    """Start the engine on a background thread (for hosts that own the main thread)."""
+    global engine_started
+    with engine_start_lock:
+        if engine_started:
+            return
+        engine_started = True
+    attach_state_store(open_state_store())
+    open_ntfy_log()
+    open_chat_archive()
+    threading.Thread(target=asyncio.run, args=(run_engine(),), daemon=True).start()
+
+# =====================================================
+# --- Web Service (fb_app) ---
+# =====================================================
+# Served by gunicorn (render.yaml: `gunicorn main:fb_app`). The first request
+# (Render's health check) starts the listeners in the background.
+FB_WEBHOOK_MAX_BODY = 1024 * 1024
+
+def verify_fb_signature(body: bytes, header: str) -> bool:
+    """Check X-Hub-Signature-256 (HMAC-SHA256 of the raw body with the app secret)."""
+    if not FB_APP_SECRET or not header or not header.startswith("sha256="):
+        return False
+    expected = hmac.new(FB_APP_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header[len("sha256="):])
+
+def fb_webhook_comments(payload: dict) -> list:
+    """Pull new comments on the live video out of a Page webhook payload, as (stream, comment) pairs.
+
+    Comments on any other post of the Page are ignored, and only accepted
+    comments count as the webhook working (see Stream.fb_push_active).
+    """
+    streams_by_page = {stream.fb_page_id: stream for stream in STREAMS if stream.fb_page_id}
+    comments = []
+    for entry in payload.get("entry", []):
+        stream = streams_by_page.get(str(entry.get("id")))
+        if stream is None:
+            continue
+        for change in entry.get("changes", []):
+            value = change.get("value") or {}
+            if change.get("field") != "feed" or value.get("item") != "comment" or value.get("verb") != "add":
+                continue
+            if str(value.get("post_id")) not in stream.fb_live_posts:
+                continue
+            stream.fb_last_push = time.time()
+            created = value.get("created_time")
+            if isinstance(created, (int, float)):
+                created = datetime.fromtimestamp(created, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000")
+            msg = ChatMessage("Facebook", value.get("comment_id"), (value.get("from") or {}).get("name", "Unknown"),
+                              value.get("message", ""), created)
+            if msg.trace is not None and parse_fb_time(created):
+                msg.mark("created", parse_fb_time(created))
+            comments.append((stream, msg))
+    return comments
+
+def ingest_fb_webhook_comments(comments: list):
+    """Runs on the engine loop: same dedup and queue as the Graph poller."""
+    for stream, msg in comments:
+        if is_new_fb_comment(stream, msg):
+            deliver_fb_comment(stream, msg)
+
+def respond(start_response, status: str, body: str = "", content_type: str = "text/plain; charset=utf-8"):
+    data = body.encode("utf-8")
+    start_response(status, [("Content-Type", content_type), ("Content-Length", str(len(data)))])
+    return [data]
+
+def handle_health(environ, start_response):
+    return respond(start_response, "200 OK", "ok")
+
+def handle_metrics(environ, start_response):
+    return respond(start_response, "200 OK", render_metrics(), "text/plain; version=0.0.4; charset=utf-8")
+
+def handle_stats(environ, start_response):
+    return respond(start_response, "200 OK", json.dumps(chat_analytics.snapshot(), ensure_ascii=False),
+                   "application/json; charset=utf-8")
+
+def handle_fb_verify(environ, start_response):
+    """Webhook subscription handshake: echo hub.challenge if the token matches."""
+    query = parse_qs(environ.get("QUERY_STRING", ""))
+    mode = query.get("hub.mode", [""])[0]
+    token = query.get("hub.verify_token", [""])[0]
+    if mode == "subscribe" and FB_VERIFY_TOKEN and hmac.compare_digest(token, FB_VERIFY_TOKEN):
+        log("info", "✅ [Facebook] Webhook verified")
+        return respond(start_response, "200 OK", query.get("hub.challenge", [""])[0])
+    return respond(start_response, "403 Forbidden", "verification failed")
+
+def handle_fb_event(environ, start_response):
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length <= 0 or length > FB_WEBHOOK_MAX_BODY:
+        return respond(start_response, "400 Bad Request", "bad body")
+    body = environ["wsgi.input"].read(length)
+    if not verify_fb_signature(body, environ.get("HTTP_X_HUB_SIGNATURE_256", "")):
+        log("warn", "⚠️ [Facebook] Webhook with a bad signature rejected")
+        return respond(start_response, "403 Forbidden", "bad signature")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return respond(start_response, "400 Bad Request", "bad json")
+    comments = fb_webhook_comments(payload)
+    if comments and not submit_to_engine(ingest_fb_webhook_comments, comments):
+        return respond(start_response, "503 Service Unavailable", "engine not running")
+    return respond(start_response, "200 OK", "EVENT_RECEIVED")
+
+FB_ROUTES = {
+    ("GET", "/"): handle_health,
+    ("GET", "/metrics"): handle_metrics,
+    ("GET", "/stats"): handle_stats,
+    ("GET", "/webhook"): handle_fb_verify,
+    ("POST", "/webhook"): handle_fb_event,
+}
+
+def fb_app(environ, start_response):
+    """WSGI entry point: health check, /metrics, /stats and the Facebook Page webhook."""
+    start_all_listeners()
+    handler = FB_ROUTES.get((environ.get("REQUEST_METHOD", "GET"), environ.get("PATH_INFO", "/")))
+    if handler is None:
+        return respond(start_response, "404 Not Found", "not found")
+    return handler(environ, start_response)
+
+# =====================================================
+# --- Sharding (coordinator / workers) ---
+# =====================================================
+# `python main.py coordinator --workers N` starts N worker processes and
+# restarts any that die. Each worker (also runnable alone, on any host that
+# reaches the same STATE_STORE) leases a fair share of STREAMS, renews its
+# leases every LEASE_TTL/3 and hands streams back when more workers join.
+# A dead worker's leases expire after LEASE_TTL and the survivors take its
+# streams over, resuming from the stored cursors. Claimed IDs in the store
+# keep a takeover from notifying anything twice, and claims the dead worker
+# never sent are re-queued by the new owner (see SharedClaims). A stream
+# handed over on purpose has its claims disowned first; the old owner drops
+# its queued copies, the new owner adopts and sends them.
+# Store calls run on the I/O pool, never on the event loop.
+async def run_worker(worker_id: str, store):
+    attach_state_store(store)
+    shared_claims.worker = worker_id
+    if NTFY_WAL_DIR:
+        open_ntfy_log(os.path.join(NTFY_WAL_DIR, worker_id))
+        await replay_ntfy_log()  # before any takeover, so our own unsent claims are not adopted twice
+    # whatever an earlier run under this ID claimed and did not replay is up for adoption
+    await run_blocking(store.disown, worker_id, keep=frozenset(shared_claims.inflight))
+    open_chat_archive()
+    by_name = {stream.name: stream for stream in STREAMS}
+    owned = {}  # stream name -> [tasks]
+
+    async def stop(name: str):
+        for task in owned.pop(name, []):
+            task.cancel()
+        await shared_claims.release(by_name[name])  # before the lease, so the next owner can adopt them
+        await run_blocking(store.release_lease, name, worker_id)
+        log("info", f"↩️ [Worker {worker_id}] Released {name}")
+
+    await run_engine_tasks(shared_listeners())
+    log("info", f"🧩 [Worker {worker_id}] Up, {len(STREAMS)} stream(s) in the pool")
+    try:
+        while True:
+            await run_blocking(store.heartbeat, worker_id)
+            workers = await run_blocking(store.live_workers) or [worker_id]
+            fair_share = math.ceil(len(STREAMS) / len(workers))
+
+            for name in list(owned):
+                if not await run_blocking(store.acquire_lease, name, worker_id):
+                    log("warn", f"⚠️ [Worker {worker_id}] Lost the lease on {name}")
+                    for task in owned.pop(name):
+                        task.cancel()
+                    await shared_claims.release(by_name[name])
+            while len(owned) > fair_share:
+                await stop(sorted(owned)[-1])
+
+            holders = await run_blocking(store.leases)
+            for name, stream in by_name.items():
+                if len(owned) >= fair_share:
+                    break
+                if name in owned or holders.get(name) not in (None, worker_id):
+                    continue
+                if await run_blocking(store.acquire_lease, name, worker_id):
+                    stream.labelled = True
+                    await run_blocking(stream.restore)
+                    adopted = await shared_claims.adopt(stream)
+                    owned[name] = await run_engine_tasks(stream_listeners(stream))
+                    log("info", f"📥 [Worker {worker_id}] Took {name}"
+                                + (f", re-queued {adopted} unsent message(s)" if adopted else ""))
+
+            for name in owned:  # claims a worker gave up or died with after we took the stream
+                adopted = await shared_claims.adopt(by_name[name])
+                if adopted:
+                    log("info", f"📥 [Worker {worker_id}] Re-queued {adopted} unsent message(s) on {name}")
+
+            await run_blocking(store.expire)
+            await asyncio.sleep(LEASE_TTL / 3)
+    finally:
+        for name in list(owned):
+            for platform in ("kick", "facebook"):
+                by_name[name].checkpoint(platform, force=True)
+        await shared_claims.flush()
+        for name in list(owned):
+            await stop(name)
+
+async def run_engine_tasks(listeners) -> list:
+    """Start listeners on the running engine loop and return their tasks."""
+    global engine_loop
+    engine_loop = asyncio.get_running_loop()
+    engine_ready.set()
+    return [asyncio.create_task(run_listener(listener), name=listener_name(listener)) for listener in listeners]
+
+def run_coordinator(workers: int):
+    """Keep `workers` worker processes alive on this host."""
+    if not STATE_STORE:
+        raise ValueError("Coordinator mode needs STATE_STORE (e.g. sqlite:///state.db)")
+    procs = {}
+    log("info", f"🧭 [Coordinator] Running {workers} worker(s) over {len(STREAMS)} stream(s)")
+    try:
+        while True:
+            for i in range(workers):
+                worker_id = f"{os.uname().nodename}-{i}"
+                proc = procs.get(worker_id)
+                if proc is None or proc.poll() is not None:
+                    if proc is not None:
+                        log("error", f"💀 [Coordinator] Worker {worker_id} exited ({proc.returncode}), restarting")
+                    procs[worker_id] = subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", "--id", worker_id])
+            time.sleep(5)
+    finally:
+        for proc in procs.values():
+            proc.terminate()
 
 # =====================================================
 # --- Entry Point ---
 # =====================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relay Kick, YouTube and Facebook live chat to ntfy.")
+    sub = parser.add_subparsers(dest="command")
+    coord = sub.add_parser("coordinator", help="run N sharded worker processes")
+    coord.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    worker = sub.add_parser("worker", help="run one sharded worker")
+    worker.add_argument("--id", default=os.getenv("WORKER_ID") or f"{os.uname().nodename}-{os.getpid()}")
+    report = sub.add_parser("trace-report", help="lag percentiles per platform and stage from TRACE_FILE")
+    report.add_argument("--file", default=TRACE_FILE or "traces.jsonl")
+    archive = sub.add_parser("archive", help="search the chat archive")
+    archive.add_argument("--file", default=CHAT_ARCHIVE or "chat.db")
+    archive.add_argument("--user")
+    archive.add_argument("--stream", help="stream name from STREAMS_CONFIG")
+    archive.add_argument("--platform", help="Kick, YouTube or Facebook")
+    archive.add_argument("--since", help="e.g. 90m, 2h, 3d or an ISO timestamp")
+    archive.add_argument("--search", help="full-text search in the message text")
+    archive.add_argument("--last-stream", action="store_true", help="only the most recent stream")
+    archive.add_argument("--limit", type=int, default=100)
+    archive.add_argument("--json", action="store_true", help="one JSON object per line")
+    args = parser.parse_args(argv)
+
+    if args.command == "trace-report":
+        trace_report(args.file)
+    elif args.command == "archive":
+        archive_cli(args)
+    elif args.command == "coordinator":
+        run_coordinator(args.workers)
+    elif args.command == "worker":
+        store = open_state_store()
+        if store is None:
+            raise ValueError("Worker mode needs STATE_STORE (e.g. sqlite:///state.db)")
+        asyncio.run(run_worker(args.id, store))
+    else:
+        attach_state_store(open_state_store())
+        open_ntfy_log()
+        open_chat_archive()
+        asyncio.run(run_engine())
+
 if __name__ == "__main__":
-    start_all_listeners()
-    while True:
-        time.sleep(60)
+    main()
@@ -0,0 +1,37 @@
+"""Regression checks for the chat rules engine: python -m pytest test_rules.py"""
+import os
+
+os.environ.setdefault("STREAMS_CONFIG", "")
+os.environ.setdefault("RULES_FILE", "")
+
+import main
+
+
+def check(rules: dict, text: str, user: str = "viewer"):
+    return main.RuleSet(rules).check(main.ChatMessage("Kick", 1, user, text))
+
+
+def test_exclude_regex_overlapping_an_include_regex_still_drops():
+    rules = {"include_regex": ["foo"], "exclude_regex": ["foobar"]}
+    assert check(rules, "foobar spam") == ("exclude", None)
+    assert check(rules, "foo spam") == (None, None)
+    assert check(rules, "spam") == ("no_match", None)
+
+
+def test_exclude_keyword_overlapping_an_include_keyword_still_drops():
+    rules = {"include": ["free"], "exclude": ["free followers"]}
+    assert check(rules, "get free followers") == ("exclude", None)
+    assert check(rules, "free stuff") == (None, None)
+
+
+def test_keywords_match_whole_words_only():
+    assert check({"exclude": ["gg"]}, "eggs") == (None, None)
+    assert check({"exclude": ["gg"]}, "GG!") == ("exclude", None)
+
+
+def test_mentions_route_to_their_topic_and_users_override_text():
+    rules = {"mentions": ["@alice"], "mention_topic": "mentions", "exclude_regex": [r"https?://\S+"],
+             "allow_users": ["mod"], "deny_users": ["bot"]}
+    assert check(rules, "hey @Alice") == (None, "mentions")
+    assert check(rules, "https://x", user="Mod") == (None, None)
+    assert check(rules, "hi", user="BOT") == ("deny_user", None)
@@ -0,0 +1,87 @@
+"""Takeover checks for the shared state store: python -m pytest test_state_store.py"""
+import asyncio
+import os
+
+os.environ.setdefault("STREAMS_CONFIG", "")
+os.environ.setdefault("RULES_FILE", "")
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = main.SQLiteStateStore(str(tmp_path / "state.db"))
+    monkeypatch.setattr(main, "state_store", store)
+    monkeypatch.setattr(main, "ntfy_queue", main.OutboundQueue())
+    return store
+
+
+def claim(store, worker: str, key: str = "alice:1"):
+    store.heartbeat(worker)
+    return store.commit(worker, [("kick", key, "alice", '{"platform": "Kick", "id": 1}')], [], {})
+
+
+def test_adopt_leaves_claims_of_a_live_worker_alone(store):
+    assert claim(store, "A") == [True]
+    store.release_lease("alice", "A")
+    store.heartbeat("B")
+    assert store.adopt("alice", "B") == []
+
+    store.disown("A", "alice")
+    assert [row[:2] for row in store.adopt("alice", "B")] == [("kick", "alice:1")]
+    assert store.adopt("alice", "B") == []
+    assert store.owned("A", [("kick", "alice:1")]) == {}
+
+
+def test_adopt_takes_claims_of_a_dead_worker(store):
+    claim(store, "A")
+    store._execute("UPDATE workers SET heartbeat = ? WHERE worker = 'A'", (0,))
+    assert [row[:2] for row in store.adopt("alice", "B")] == [("kick", "alice:1")]
+
+
+def test_rebalance_sends_each_claim_from_one_worker_only(store):
+    async def run():
+        stream = main.Stream("alice")
+        a, b = main.SharedClaims(), main.SharedClaims()
+        a.worker, b.worker = "A", "B"
+        store.heartbeat("A")
+        store.heartbeat("B")
+
+        queued_by_a = []
+        a.submit(stream, main.ChatMessage("Kick", 1, "viewer", "hi"), queued_by_a.append)
+        await a.flush()
+        [msg] = queued_by_a
+        assert a.owns(msg)
+
+        await a.release(stream)  # A hands the stream to B with the message still queued
+        assert not a.owns(msg)
+        a.done(msg)  # A's sender skips it; that must not mark it delivered
+        await a.flush()
+
+        assert await b.adopt(stream) == 1
+        adopted = main.ntfy_queue.get_nowait()
+        assert adopted.claim == msg.claim and b.owns(adopted)
+        b.done(adopted)
+        await b.flush()
+        assert store.adopt("alice", "C") == []
+
+    asyncio.run(run())
+
+
+def test_batcher_drops_lines_of_a_released_stream(store, monkeypatch):
+    async def run():
+        stream = main.Stream("alice")
+        claims = main.SharedClaims()
+        claims.worker = "A"
+        monkeypatch.setattr(main, "shared_claims", claims)
+        store.heartbeat("A")
+
+        batcher = main.NtfyBatcher()
+        claims.submit(stream, main.ChatMessage("Kick", 1, "viewer", "hi"), batcher.add)
+        await claims.flush()
+        await claims.release(stream)
+        assert batcher.take() == []
+
+    asyncio.run(run())